@@ -0,0 +1,113 @@
+import json
+import os
+import threading
+import logging
+from collections import defaultdict
+from datetime import datetime
+
+from image_variants import VARIANT_FORMATS
+
+logger = logging.getLogger(__name__)
+
+HOUR_FORMAT = "%Y-%m-%dT%H"
+
+
+def hour_bucket(timestamp: datetime) -> datetime:
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+class ActivityIndex:
+    """
+    Generation counter and per-hour histogram kept in memory and updated
+    when a generation completes, so the dashboard never rescans the outputs
+    directory. Updates only mark the index dirty; `flush()` (called by the
+    app's scheduler and at exit) saves it as compact JSON, which is loaded
+    at startup. Only when there is no saved index is the directory scanned,
+    once.
+
+    Parameters:
+    - path (str): JSON file where the index is persisted.
+    - directory (str): Outputs directory, scanned if there is no saved index.
+    - extension (str): Extension of the generated images.
+    """
+
+    def __init__(self, path: str, directory: str, extension: str = "png"):
+        self.path = path
+        self.directory = directory
+        self.extension = extension.lower().lstrip('.')
+        self.total = 0
+        self.hours = defaultdict(int)
+        self.dirty = False
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.total = data["total"]
+            self.hours = defaultdict(int, {datetime.strptime(k, HOUR_FORMAT): v for k, v in data["hours"].items()})
+            return
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError) as e:
+            logger.warning(f"Activity index {self.path} is invalid, rebuilding: {e}")
+
+        self.rebuild()
+
+    def rebuild(self):
+        logger.info(f"Rebuilding activity index from {self.directory}.")
+        total = 0
+        hours = defaultdict(int)
+        variant_suffixes = tuple(f"_{variant}" for variant in VARIANT_FORMATS)
+        if os.path.isdir(self.directory):
+            for entry in os.scandir(self.directory):
+                stem, extension = os.path.splitext(entry.name)
+                # as versoes derivadas nao sao geracoes novas
+                if not entry.is_file() or extension.lower() != f".{self.extension}" or stem.endswith(variant_suffixes):
+                    continue
+                total += 1
+                hours[hour_bucket(datetime.fromtimestamp(entry.stat().st_mtime))] += 1
+
+        with self.lock:
+            self.total = total
+            self.hours = hours
+            self.dirty = True
+        self.flush()
+
+    def record(self, timestamp: datetime = None):
+        timestamp = timestamp or datetime.now()
+        with self.lock:
+            self.total += 1
+            self.hours[hour_bucket(timestamp)] += 1
+            self.dirty = True
+
+    def by_hour(self) -> dict:
+        with self.lock:
+            return dict(self.hours)
+
+    def flush(self):
+        # a gravacao fica fora do lock: record() nunca espera pelo disco
+        with self.save_lock:
+            with self.lock:
+                if not self.dirty:
+                    return
+                self.dirty = False
+                data = {"total": self.total,
+                        "hours": {k.strftime(HOUR_FORMAT): v for k, v in sorted(self.hours.items())}}
+            if not self._save(data):
+                with self.lock:
+                    self.dirty = True
+
+    def _save(self, data: dict) -> bool:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        partial = f"{self.path}.part"
+        try:
+            with open(partial, "w", encoding="utf-8") as f:
+                json.dump(data, f, separators=(",", ":"))
+            os.replace(partial, self.path)
+            return True
+        except OSError as e:
+            logger.warning(f"Could not save activity index {self.path}: {e}")
+            return False
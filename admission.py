@@ -0,0 +1,80 @@
+import math
+import threading
+import time
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, retry_after: int, outstanding: int):
+        super().__init__(f"{outstanding} generations outstanding, retry in {retry_after}s")
+        self.retry_after = retry_after
+        self.outstanding = outstanding
+
+
+class AdmissionTicket:
+    def __init__(self, position: int, eta_seconds: float):
+        self.position = position
+        self.eta_seconds = eta_seconds
+        self.admitted_at = time.time()
+        self.estimated_completion = self.admitted_at + eta_seconds
+        self.released = False
+
+    def to_dict(self) -> dict:
+        return {"position": self.position, "eta_seconds": round(self.eta_seconds),
+                "estimated_completion": self.estimated_completion}
+
+
+class AdmissionController:
+    """
+    Decides, before any work starts, whether a generation can still finish
+    in reasonable time. It counts outstanding generations (admitted and
+    not finished) and keeps a moving average of how long one takes end to
+    end; past `max_outstanding` new requests are refused with the time
+    until a slot should free up, instead of waiting minutes in ComfyUI's
+    queue after the user has left.
+
+    Parameters:
+    - max_outstanding (int): Generations admitted at the same time.
+    - parallelism (int): Generations the GPUs run at the same time (backends).
+    - initial_service_time (float): Seconds per generation until one is measured.
+    - ewma_alpha (float): Weight of each new measurement in the average.
+    """
+
+    def __init__(self, max_outstanding: int, parallelism: int = 1, initial_service_time: float = 15.0,
+                 ewma_alpha: float = 0.2):
+        self.max_outstanding = max_outstanding
+        self.parallelism = max(1, parallelism)
+        self.service_time = initial_service_time
+        self.ewma_alpha = ewma_alpha
+        self.outstanding = 0
+        self.lock = threading.Lock()
+
+    def admit(self) -> AdmissionTicket:
+        """Returns a ticket with the wait estimate, or raises AdmissionRejected."""
+        with self.lock:
+            if self.outstanding >= self.max_outstanding:
+                # tempo ate a fila voltar para baixo do limite
+                excess = self.outstanding - self.max_outstanding + 1
+                retry_after = max(1, math.ceil(excess / self.parallelism * self.service_time))
+                raise AdmissionRejected(retry_after, self.outstanding)
+            position = self.outstanding
+            self.outstanding += 1
+            # rodadas completas de GPU a frente desta, mais a propria execucao
+            eta = (position // self.parallelism + 1) * self.service_time
+        return AdmissionTicket(position, eta)
+
+    def release(self, ticket: AdmissionTicket, success: bool = True):
+        with self.lock:
+            if ticket.released:
+                return
+            ticket.released = True
+            self.outstanding -= 1
+            if success:
+                # esperou `rounds` rodadas de GPU (as da frente e a propria): o tempo de uma e a fracao
+                rounds = ticket.position // self.parallelism + 1
+                measured = (time.time() - ticket.admitted_at) / rounds
+                self.service_time += self.ewma_alpha * (measured - self.service_time)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"outstanding": self.outstanding, "max_outstanding": self.max_outstanding,
+                    "service_time": round(self.service_time, 2), "parallelism": self.parallelism}
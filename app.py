@@ -3,9 +3,15 @@ from flask import Flask, url_for, send_file, render_template, redirect, request,
 
 import parameters
 import utils
-from log_sender import init_csv, csv_filename, backup_filename, process_csv_and_send_logs, save_csv
-from qrcodeaux import generate_qr_code
+from log_sender import init_csv, csv_filename, backup_filename, process_csv_and_send_logs, save_csv, save_csv_additional
+from qrcodeaux import generate_qr_code, qr_code_png
 from udp_sender import UDPSender
+from retention import RetentionManager
+from artifact_delivery import send_artifact
+from thumbnails import ThumbnailCache
+import node_profiler
+from werkzeug.utils import safe_join
+import io
 import uuid
 import os
 import time
@@ -38,29 +44,18 @@ ss_api = ComfyUiAPI(parameters.STABLE_SWARM_API_SERVER,
                     parameters.WORKFLOW_NODE_ID_KSAMPLER,
                     parameters.WORKFLOW_NODE_ID_IMAGE_LOAD)
 
-def remove_old_folders():
-    current_time = time.time()
-    directory = 'static/download_images'
-    minutes = 10
+# as pastas de static/download_images sao criadas por outro processo: o gerenciador as descobre sozinho
+retention = RetentionManager({folder: parameters.RETENTION_RULES[folder]
+                              for folder in ('static/download_images', 'static/thumbnails')})
 
-    for foldername in os.listdir(directory):
-        folder_path = os.path.join(directory, foldername)
+thumbnails = ThumbnailCache(os.path.join(app.root_path, 'static', 'thumbnails'), parameters.THUMBNAIL_WIDTHS)
 
-        if os.path.isdir(folder_path):
-            creation_time = os.path.getctime(folder_path)
-            time_difference = (current_time - creation_time) / 60
-
-            if time_difference > minutes:
-
-                shutil.rmtree(folder_path)
-                print(f'A pasta "{foldername}" foi excluída.')
-            else:
-                print(f'A pasta "{foldername}" foi criada há menos de {minutes} minutos.')
-
-
-# scheduler = BackgroundScheduler()
-# scheduler.add_job(remove_old_folders, 'interval', minutes=2)
-# scheduler.start()
+scheduler = BackgroundScheduler()
+scheduler.add_job(retention.sweep, 'interval', seconds=parameters.RETENTION_SWEEP_SECONDS,
+                  max_instances=1, coalesce=True)
+scheduler.add_job(node_profiler.profiler.flush, 'interval', seconds=parameters.NODE_PROFILE_SAVE_SECONDS,
+                  max_instances=1, coalesce=True)
+scheduler.start()
 
 threading.Thread(target=process_csv_and_send_logs, args=(csv_filename, backup_filename), daemon=True).start()
 
@@ -75,6 +70,11 @@ def alive():
     return "Alive"
 
 
+@app.route('/retention')
+def retention_stats():
+    return jsonify(retention.stats())
+
+
 @app.route("/cta", methods=['GET', 'POST'])
 def cta():
     if request.method == "POST":
@@ -96,7 +96,10 @@ def generate():
 
     qr_img = generate_qr_code(link)
 
-    return send_file(qr_img, mimetype='image/png')
+    # link novo a cada chamada: nunca reaproveitar
+    response = send_file(qr_img, mimetype='image/png')
+    response.cache_control.no_store = True
+    return response
 
 
 @app.route('/qrcode-images', methods=['GET'])
@@ -107,11 +110,16 @@ def qrcode_images():
 
     url = f"{parameters.BASE_URL}/show_images/{cod}"
 
-    img_bytes = generate_qr_code(url)
+    png, etag = qr_code_png(url)
 
     socketio.emit('render_images', {'cod': cod}, room=cod, namespace='/')
 
-    return send_file(img_bytes, mimetype='image/png')
+    # o QR de um cod nunca muda, mas cada acesso precisa chegar aqui para emitir o evento:
+    # o cliente revalida com If-None-Match e recebe 304 sem corpo
+    response = send_file(io.BytesIO(png), mimetype='image/png', etag=etag, conditional=True)
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response
 
 
 @app.route('/download-images')
@@ -134,13 +142,12 @@ def download_images():
 
 @app.route('/images/<cod>/<filename>')
 def serve_image(cod, filename):
-    folder_path = os.path.join(IMAGE_BASE_FOLDER, cod)
-    file_path = os.path.join(folder_path, filename)
+    file_path = safe_join(IMAGE_BASE_FOLDER, cod, filename)
 
-    if not os.path.exists(file_path) or not os.path.isfile(file_path):
+    if file_path is None or not os.path.isfile(file_path):
         abort(404, description="Image not found.")
 
-    return send_file(file_path, mimetype='image/jpeg', as_attachment=True, download_name=filename)
+    return send_artifact(file_path, as_attachment=True, download_name=filename)
 
 
 @app.route('/show_images/<cod>')
@@ -152,12 +159,12 @@ def show_images(cod):
 
     image_files = [f for f in os.listdir(images_dir) if f.endswith(('.png', '.jpg', '.jpeg', '.gif'))]
 
-    image_paths = [url_for('static', filename=f'download_images/{cod}/{image_file}') for image_file in image_files]
+    images = [gallery_image(cod, image_file) for image_file in image_files]
 
     udp_sender.send(f"SCAN:{cod}\n")
     save_csv("ESCANEOU_QRCODE")
 
-    return render_template('download-images.html', image_paths=image_paths, cod=cod)
+    return render_template('download-images.html', images=images, cod=cod)
 
 
 @app.route('/show_images_carousel/<cod>')
@@ -169,10 +176,34 @@ def show_images_carousel(cod):
 
     image_files = [f for f in os.listdir(images_dir) if f.endswith(('.png', '.jpg', '.jpeg', '.gif'))]
 
-    image_paths = [url_for('static', filename=f'download_images/{cod}/{image_file}') for image_file in image_files]
+    images = [gallery_image(cod, image_file) for image_file in image_files]
     save_csv("MOSTROU_FOTOS")
 
-    return render_template('download-images-carousel.html', image_paths=image_paths, cod=cod)
+    return render_template('download-images-carousel.html', images=images, cod=cod)
+
+
+def gallery_image(cod, image_file):
+    # original para baixar/compartilhar; miniaturas em varias larguras para exibir
+    thumbs = [(width, url_for('thumbnail', cod=cod, filename=image_file, w=width))
+              for width in parameters.THUMBNAIL_WIDTHS]
+    return {'url': url_for('static', filename=f'download_images/{cod}/{image_file}'),
+            'src': thumbs[len(thumbs) // 2][1],
+            'srcset': ", ".join(f"{url} {width}w" for width, url in thumbs)}
+
+
+@app.route('/thumbs/<cod>/<filename>')
+def thumbnail(cod, filename):
+    source_path = safe_join(IMAGE_BASE_FOLDER, cod, filename)
+    if source_path is None or not os.path.isfile(source_path):
+        abort(404, description="Image not found.")
+
+    width = request.args.get('w', parameters.THUMBNAIL_WIDTHS[-1], type=int)
+    entry = thumbnails.negotiate(request.accept_mimetypes)
+    thumb_path = thumbnails.get(source_path, f"{cod}/{filename}", width, entry)
+
+    response = send_artifact(thumb_path)
+    response.vary.add('Accept')
+    return response
 
 
 @app.route('/terms')
@@ -202,7 +233,7 @@ def send_log(status):
 
 @app.route('/logs/finish/<status>/<additional_send>')
 def finish(status, additional_send):
-    save_csv(status, additional_send)
+    save_csv_additional(status, additional_send)
     return redirect(url_for('cta'))
 
 
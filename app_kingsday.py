@@ -1,20 +1,35 @@
 import os
-import asyncio
+import json
+import shutil
+import tempfile
+import atexit
 
 from apscheduler.schedulers.background import BackgroundScheduler
-from flask import Flask, request, render_template, redirect, url_for, jsonify
+from flask import Flask, Request, request, render_template, redirect, url_for, jsonify, Response, stream_with_context, abort
 from werkzeug.exceptions import BadRequestKeyError
+from werkzeug.utils import safe_join
 from concurrent.futures import ThreadPoolExecutor
 from flask_cors import CORS
-import time
 import uuid
 import logging
 
 from comfyui_api import ComfyUiAPI
 # from comfyui_api_aws import ComfyUiAPI
+# from comfyui_api_async import ComfyUiAPI
 
 import parameters as param
-from utils import generate_timestamped_filename, count_files_with_extension, count_files_by_hour, generate_file_activity_plot_base64, read_last_n_lines
+import metrics
+from job_manager import JobManager, JobQueueFull
+from admission import AdmissionController, AdmissionRejected
+from deadline import Deadline, DeadlineExceeded
+from batching import MicroBatcher
+from image_preprocess import ImagePreprocessor, working_resolution
+from image_variants import VariantEncoder
+from activity_index import ActivityIndex
+import node_profiler
+from retention import RetentionManager
+from artifact_delivery import send_artifact
+from utils import generate_timestamped_filename, generate_file_activity_svg, read_last_n_lines
 
 # Configure logging to write to a file and to the std output
 logger = logging.getLogger()
@@ -40,28 +55,126 @@ logger.addHandler(stream_handler)
 logger = logging.getLogger(__name__)
 
 
+class SpooledRequest(Request):
+    # a foto fica em memoria; so uploads acima de UPLOAD_SPOOL_THRESHOLD vao para um arquivo temporario
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=param.UPLOAD_SPOOL_THRESHOLD, mode="rb+")
+
+
 app = Flask(__name__)
+app.request_class = SpooledRequest
 CORS(app)
 app.config['UPLOAD_FOLDER'] = 'static/inputs'
 app.config['OUTPUT_FOLDER'] = 'static/outputs'
 
-executor = ThreadPoolExecutor()
+admission = AdmissionController(max_outstanding=param.ADMISSION_MAX_OUTSTANDING,
+                                parallelism=param.ADMISSION_PARALLELISM or len(param.COMFYUI_API_SERVERS),
+                                initial_service_time=param.ADMISSION_INITIAL_SERVICE_TIME)
+jobs = JobManager(max_workers=param.JOB_MAX_WORKERS,
+                  max_pending=param.JOB_MAX_PENDING,
+                  ttl_seconds=param.JOB_TTL_SECONDS)
+archive_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="archive")
 
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
 
 api = ComfyUiAPI(
-    server_address=param.COMFYUI_API_SERVER,
+    server_address=param.COMFYUI_API_SERVERS,
     img_temp_folder=app.config['OUTPUT_FOLDER'],
     workflow_path=param.WORKFLOW_PATH,
     node_id_ksampler=param.WORKFLOW_NODE_ID_KSAMPLER,
     node_id_image_load=param.WORKFLOW_NODE_ID_IMAGE_LOAD,
-    node_id_text_input=param.WORKFLOW_NODE_ID_TEXT_INPUT
+    node_id_text_input=param.WORKFLOW_NODE_ID_TEXT_INPUT,
+    output_node=param.WORKFLOW_OUTPUT_NODE,
+    output_index=param.WORKFLOW_OUTPUT_INDEX,
+    generation_timeout=param.GENERATION_TIMEOUT
 )
 
+# com BATCH_WINDOW_MS, pedidos que chegam juntos (mesma escolha rei/rainha) viram um unico prompt
+generator = api
+if param.BATCH_WINDOW_MS:
+    if hasattr(api, 'generate_batch'):
+        generator = MicroBatcher(api, window=param.BATCH_WINDOW_MS / 1000, max_batch=param.BATCH_MAX_SIZE)
+    else:
+        logger.warning(f"{type(api).__module__} does not support batching; BATCH_WINDOW_MS ignored.")
+
+
+preprocessor = None
+if param.PREPROCESS_INPUTS:
+    preprocessor = ImagePreprocessor(
+        max_side=param.PREPROCESS_MAX_SIDE or working_resolution(param.WORKFLOW_PATH, param.WORKFLOW_NODE_ID_IMAGE_LOAD),
+        quality=param.PREPROCESS_JPEG_QUALITY,
+        max_workers=param.PREPROCESS_WORKERS
+    )
+
+variant_encoder = VariantEncoder(param.OUTPUT_VARIANTS, max_workers=param.OUTPUT_VARIANT_WORKERS)
+activity = ActivityIndex(param.ACTIVITY_INDEX_PATH, app.config['OUTPUT_FOLDER'])
+retention = RetentionManager({folder: param.RETENTION_RULES[folder]
+                              for folder in (app.config['OUTPUT_FOLDER'], app.config['UPLOAD_FOLDER'])})
+
+
+def process_image(image, is_king, filename=None, deadline=None):
+    if preprocessor is not None:
+        image = preprocessor.process(image)
+    result_path = generator.generate_image(image, is_king=is_king, filename=filename, deadline=deadline)
+    activity.record()
+    retention.track(result_path)
+    return result_path
+
+
+def to_output_url(result_path):
+    # servido por /outputs, com ETag e cache imutavel (ver serve_output)
+    relative_path = os.path.relpath(result_path, app.config['OUTPUT_FOLDER']).replace("\\", "/")
+    return f'/outputs/{relative_path}'
 
-def process_image(image_path, is_king):
-    return api.generate_image(image_path, is_king=is_king)
+
+def write_file(filename, data):
+    with open(filename, "wb") as f:
+        f.write(data)
+    retention.track(filename, len(data))
+
+
+def archive_input(image, filename):
+    # copia da foto original para static/inputs, gravada depois da resposta
+    if not param.ARCHIVE_INPUTS:
+        return
+    image.seek(0)
+    archive_executor.submit(write_file, filename, image.read())
+
+
+def spool_upload(stream):
+    # o stream da requisicao e fechado no fim do request; o job precisa de uma copia propria
+    spooled = tempfile.SpooledTemporaryFile(max_size=param.UPLOAD_SPOOL_THRESHOLD)
+    shutil.copyfileobj(stream, spooled)
+    spooled.seek(0)
+    return spooled
+
+
+def publish_variants(result, result_path):
+    # o resultado ja aponta para os bytes originais; cada versao entra quando estiver pronta no disco
+    def on_ready(variant, path):
+        retention.track(path)
+        variants = dict(result['variants'])
+        variants[variant] = to_output_url(path)
+        result['variants'] = variants  # troca a referencia para nao alterar um dict sendo serializado
+        if variant == "png":
+            result['image_url'] = variants[variant]  # mesma imagem, arquivo menor
+
+    variant_encoder.submit(result_path, on_ready)
+
+
+def process_image_job(image, is_king, filename, ticket, deadline):
+    success = False
+    try:
+        result_path = process_image(image, is_king, filename, deadline)
+        success = True
+        archive_input(image, filename)
+    finally:
+        image.close()
+        admission.release(ticket, success)
+    result = {'image_url': to_output_url(result_path), 'variants': {}}
+    publish_variants(result, result_path)
+    return result
 
 
 @app.route('/', methods=['GET'])
@@ -88,67 +201,162 @@ def api_upload():
         logger.info(f"Invalid filename: '{file.filename}'.")
         return jsonify({'error': 'Nome de arquivo inválido'}), 400
 
+    # recusa antes de copiar a foto ou falar com o ComfyUI se a fila ja passou do que da para atender
+    # a tempo (o corpo da requisicao ja foi lido por request.files)
+    try:
+        ticket = admission.admit()
+    except AdmissionRejected as e:
+        logger.warning(f"Refusing upload: {e}")
+        response = jsonify({'error': 'Muitas pessoas na fila, tente novamente em instantes',
+                            'retry_after': e.retry_after})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 429
+
     filename = generate_timestamped_filename(app.config['UPLOAD_FOLDER'], f"kingsday_in_{str(uuid.uuid4())}", "jpg")
-    logger.info(f"Request to generate a {gender_choice} with image '{filename}'.")
+    logger.info(f"Request to generate a {gender_choice} with image '{filename}' (eta {ticket.eta_seconds:.0f}s).")
+
+    # a foto vai direto do corpo da requisicao para o ComfyUI, sem file.save()
+
+    # modo job: responde imediatamente e a geracao roda em background
+    if request.values.get('mode') == 'job':
+        # o mesmo deadline vai para o job (DELETE, abandono) e para a geracao
+        deadline = Deadline(param.GENERATION_TIMEOUT)
+        image = None
+        try:
+            image = spool_upload(file.stream)
+            job = jobs.submit(process_image_job, image, is_king, filename, ticket, deadline,
+                              metadata={'choice': gender_choice, **ticket.to_dict()}, deadline=deadline)
+        except Exception as e:
+            # o job nao foi aceito (fila cheia, erro de I/O, cliente abortou): o ticket nao pode ficar preso
+            if image is not None:
+                image.close()
+            admission.release(ticket, success=False)
+            if not isinstance(e, JobQueueFull):
+                raise
+            logger.warning(f"Job queue full, refusing '{filename}': {e}")
+            return jsonify({'error': 'Servidor ocupado, tente novamente'}), 503
+
+        logger.info(f"Queued job {job.id} for '{filename}'.")
+        return jsonify({'message': 'Imagem recebida', 'job_id': job.id,
+                        'status_url': url_for('api_job_status', job_id=job.id),
+                        'events_url': url_for('api_job_events', job_id=job.id),
+                        **ticket.to_dict()}), 202
+
+    success = False
+    try:
+        result_path = process_image(file.stream, is_king, filename, Deadline(param.GENERATION_TIMEOUT))
+        success = True
+    except DeadlineExceeded:
+        logger.warning(f"Generation for '{filename}' exceeded {param.GENERATION_TIMEOUT}s.")
+        return jsonify({'error': 'Tempo esgotado, tente novamente'}), 504
+    finally:
+        admission.release(ticket, success)
+    archive_input(file.stream, filename)
+    image_url = to_output_url(result_path)
+    # a resposta sincrona sai antes das versoes ficarem prontas: so o modo job publica as URLs delas
+    variant_encoder.submit(result_path, lambda variant, path: retention.track(path))
 
-    # input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(filename)
+    logger.info(f"Finished to generate a {gender_choice} with image '{file.filename}'.")
+    return jsonify({'message': 'Imagem processada com sucesso', 'image_url': image_url}), 200
 
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    result_path = api.generate_image(filename, is_king=is_king)
 
-    relative_path = os.path.relpath(result_path, 'static').replace("\\", "/")
-    image_url = f'/static/{relative_path}'
+@app.route('/outputs/<path:filename>', methods=['GET'])
+def serve_output(filename):
+    file_path = safe_join(app.config['OUTPUT_FOLDER'], filename)
+    if file_path is None or not os.path.isfile(file_path):
+        abort(404)
+    return send_artifact(file_path)
 
-    logger.info(f"Finished to generate a {gender_choice} with image '{file.filename}'.")
-    return jsonify({'message': 'Imagem processada com sucesso', 'image_url': image_url}), 200
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def api_job_status(job_id):
+    # ?wait=N faz long-polling por ate N segundos (maximo 30)
+    wait = min(request.args.get('wait', 0, type=float), 30.0)
+    job = jobs.wait(job_id, wait)
+    if job is None:
+        return jsonify({'error': 'Job não encontrado'}), 404
+    return jsonify(job.to_dict()), 200
+
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def api_job_cancel(job_id):
+    # tira o prompt da fila do ComfyUI (ou interrompe) e libera a thread do job
+    job = jobs.cancel(job_id)
+    if job is None:
+        return jsonify({'error': 'Job não encontrado'}), 404
+    if job.finished:
+        return jsonify(job.to_dict()), 200
+    return jsonify(job.to_dict()), 202
+
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def api_job_events(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job não encontrado'}), 404
+
+    def stream():
+        # Server-Sent Events: comentario de keep-alive a cada 15s ate o job terminar;
+        # jobs.wait marca o job como acompanhado enquanto o cliente estiver conectado
+        while not jobs.wait(job.id, 15).finished:
+            yield ": keep-alive\n\n"
+        yield f"event: {job.status}\ndata: {json.dumps(job.to_dict())}\n\n"
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 
 @app.route('/stats')
 def stats():
-    OUTPUT_DIR = "static/outputs"
-    total_files = count_files_with_extension(OUTPUT_DIR, "png")
-    activity = count_files_by_hour(OUTPUT_DIR)
-    graph_base64 = generate_file_activity_plot_base64(activity, style="plot")
+    # contadores mantidos em memoria a cada geracao; nada de varrer static/outputs
+    total_files = activity.total
+    # SVG memoizado sobre o histograma: so e refeito quando uma hora muda
+    graph_svg = generate_file_activity_svg(activity.by_hour())
     last_log_lines = read_last_n_lines(log_filename, 100)
 
     return render_template('stats.html',
                            total_files=total_files,
-                           graph_base64=graph_base64,
+                           graph_svg=graph_svg,
+                           stages=metrics.STAGE_SECONDS.summary("stage"),
                            log_text=last_log_lines)
 
 
-# async def run_async_process(image_path, is_king):
-#     loop = asyncio.get_event_loop()
-#     return await loop.run_in_executor(executor, process_image, image_path, is_king)
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.registry.render(), mimetype=metrics.CONTENT_TYPE)
+
 
+@app.route('/stats/activity.json')
+def stats_activity():
+    # serie crua para quem quiser desenhar o grafico no navegador
+    return jsonify({'total': activity.total,
+                    'hours': [{'hour': hour.isoformat(), 'count': count}
+                              for hour, count in sorted(activity.by_hour().items())]})
 
-def remove_old_files(minutes=10):
-    directories = ['static/outputs', 'static/inputs']
-    current_time = time.time()
 
-    for directory in directories:
-        if os.path.exists(directory):
-            for filename in os.listdir(directory):
-                file_path = os.path.join(directory, filename)
+@app.route('/api/admission', methods=['GET'])
+def api_admission():
+    # estado da fila, para a pagina mostrar a espera antes do envio
+    return jsonify(admission.stats()), 200
 
-                if os.path.isfile(file_path):
-                    creation_time = os.path.getctime(file_path)
-                    time_difference = (current_time - creation_time) / 60
 
-                    if time_difference > minutes:
-                        os.remove(file_path)
-                        print(f'O arquivo "{filename}" foi excluído de "{directory}".')
-                    else:
-                        print(f'O arquivo "{filename}" em "{directory}" foi criado há menos de {minutes} minutos.')
-        else:
-            print(f'O diretório "{directory}" não existe.')
+@app.route('/stats/retention.json')
+def stats_retention():
+    return jsonify(retention.stats())
 
 
-# scheduler = BackgroundScheduler()
-# scheduler.add_job(remove_old_files, 'interval', minutes=15)
-# scheduler.start()
+scheduler = BackgroundScheduler()
+scheduler.add_job(retention.sweep, 'interval', seconds=param.RETENTION_SWEEP_SECONDS,
+                  max_instances=1, coalesce=True)
+# jobs que ninguem consulta mais: o cliente foi embora, a GPU volta para quem esta esperando
+scheduler.add_job(jobs.cancel_abandoned, 'interval', args=[param.JOB_ABANDON_SECONDS],
+                  seconds=max(1, param.JOB_ABANDON_SECONDS // 4), max_instances=1, coalesce=True)
+scheduler.add_job(activity.flush, 'interval', seconds=param.ACTIVITY_INDEX_SAVE_SECONDS,
+                  max_instances=1, coalesce=True)
+scheduler.add_job(node_profiler.profiler.flush, 'interval', seconds=param.NODE_PROFILE_SAVE_SECONDS,
+                  max_instances=1, coalesce=True)
+scheduler.start()
+atexit.register(activity.flush)
 
 if __name__ == '__main__':
     logger.info("Application started (logging to file).")
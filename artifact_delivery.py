@@ -0,0 +1,75 @@
+import hashlib
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+
+from flask import Response, current_app, request, send_file
+
+import parameters as param
+
+ONE_YEAR = 365 * 24 * 3600
+
+_etags = OrderedDict()
+_etags_lock = threading.Lock()
+_ETAG_CACHE_SIZE = 4096
+
+
+def content_etag(path: str) -> str:
+    """
+    Strong ETag from the file content. Generated files are never rewritten
+    under the same name, so the hash is computed once per (path, mtime,
+    size) and kept in a small LRU.
+    """
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    with _etags_lock:
+        etag = _etags.get(key)
+        if etag is not None:
+            _etags.move_to_end(key)
+            return etag
+
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    etag = digest.hexdigest()
+
+    with _etags_lock:
+        _etags[key] = etag
+        if len(_etags) > _ETAG_CACHE_SIZE:
+            _etags.popitem(last=False)
+    return etag
+
+
+def send_artifact(path: str, as_attachment: bool = False, download_name: str = None) -> Response:
+    """
+    Sends a generated file with a content ETag and an immutable, one-year
+    Cache-Control, answering conditional (If-None-Match) and Range
+    requests. If X_ACCEL_REDIRECT_PREFIX is set, the body is left to the
+    fronting proxy (nginx X-Accel-Redirect) and only the headers come from
+    here.
+
+    Parameters:
+    - path (str): File to send, inside the static folder.
+    - as_attachment (bool): Ask the browser to download instead of display.
+    - download_name (str): Name suggested for the download.
+    """
+    mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    etag = content_etag(path)
+
+    if param.X_ACCEL_REDIRECT_PREFIX:
+        relative_path = os.path.relpath(os.path.abspath(path), current_app.static_folder).replace("\\", "/")
+        response = Response(mimetype=mimetype)
+        response.headers["X-Accel-Redirect"] = f"{param.X_ACCEL_REDIRECT_PREFIX.rstrip('/')}/{relative_path}"
+        if as_attachment:
+            response.headers.set("Content-Disposition", "attachment", filename=download_name or os.path.basename(path))
+        response.set_etag(etag)
+    else:
+        response = send_file(os.path.abspath(path), mimetype=mimetype, as_attachment=as_attachment,
+                             download_name=download_name, etag=etag, conditional=True, max_age=ONE_YEAR)
+
+    response.cache_control.public = True
+    response.cache_control.max_age = ONE_YEAR
+    response.cache_control.immutable = True
+    return response.make_conditional(request) if param.X_ACCEL_REDIRECT_PREFIX else response
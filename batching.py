@@ -0,0 +1,154 @@
+import threading
+import time
+import logging
+from concurrent.futures import Future, CancelledError, TimeoutError
+
+from deadline import Deadline, GenerationCancelled
+
+logger = logging.getLogger(__name__)
+
+
+class _BatchFailed(Exception):
+    """The batch prompt failed; the member should be generated on its own."""
+
+
+class _Member:
+    def __init__(self, image, filename: str, deadline: Deadline):
+        self.image = image
+        self.filename = filename
+        self.deadline = deadline
+        self.future = Future()
+
+
+class _Batch:
+    def __init__(self, key: tuple):
+        self.key = key
+        self.members = []
+        self.full = threading.Event()
+        self.opened_at = time.monotonic()
+
+
+class MicroBatcher:
+    """
+    Packs generations that arrive close together into a single ComfyUI
+    prompt. The first request of a key (workflow and king/queen choice)
+    opens a batch and waits up to `window` seconds, or until `max_batch`
+    requests joined; its thread then submits the whole batch with
+    `api.generate_batch` and hands each member its own image. The others
+    just wait for their result, so latency grows by at most `window`.
+
+    One bad input (e.g. no face for AutoCropFaces) fails the whole batch
+    prompt, so when a batch fails each member that is still waiting is
+    generated again on its own, from its own thread.
+
+    Same interface as ComfyUiAPI.generate_image, so the app can use either.
+
+    Parameters:
+    - api: Client with `generate_batch` (comfyui_api.ComfyUiAPI).
+    - window (float): Seconds a batch stays open for new members.
+    - max_batch (int): Members per prompt; a full batch is sent right away.
+    """
+
+    def __init__(self, api, window: float = 0.25, max_batch: int = 4):
+        self.api = api
+        self.window = window
+        self.max_batch = max_batch
+        self.open_batches = {}
+        self.lock = threading.Lock()
+
+    def generate_image(self, image, is_king=True, filename: str = None, deadline: Deadline = None) -> str:
+        deadline = deadline or Deadline(self.api.generation_timeout)
+        member = _Member(image, filename, deadline)
+        key = (self.api.workflow_name, is_king)
+        with self.lock:
+            batch = self.open_batches.get(key)
+            leader = batch is None
+            if leader:
+                batch = self.open_batches[key] = _Batch(key)
+            batch.members.append(member)
+            if len(batch.members) >= self.max_batch:
+                self._close(batch)
+
+        if leader:
+            batch.full.wait(deadline.timeout(self.window))
+            with self.lock:
+                self._close(batch)
+            self._run(batch, is_king)
+        try:
+            return self._wait(member)
+        except _BatchFailed as e:
+            logger.warning(f"Batch failed ({e}), generating {member.filename or 'member'} alone.")
+            return self.api.generate_image(member.image, is_king, member.filename, member.deadline)
+
+    def _close(self, batch: _Batch):
+        # chamado com self.lock: ninguem mais entra neste lote
+        if self.open_batches.get(batch.key) is batch:
+            del self.open_batches[batch.key]
+        batch.full.set()
+
+    def _run(self, batch: _Batch, is_king: bool):
+        # quem desistiu enquanto o lote estava aberto nao vai para a GPU
+        members = []
+        for m in batch.members:
+            try:
+                m.deadline.check()
+                members.append(m)
+            except GenerationCancelled as e:
+                self._fail(m, e)
+        if not members:
+            return
+
+        # o prompt do lote vive enquanto algum membro ainda espera por ele
+        deadline = Deadline(max(m.deadline.timeout(self.api.generation_timeout) for m in members))
+        remaining = [len(members)]
+        remaining_lock = threading.Lock()
+
+        def member_gone():
+            with remaining_lock:
+                remaining[0] -= 1
+                everyone_gone = remaining[0] == 0
+            if everyone_gone:
+                deadline.cancel("Every member of the batch went away")
+
+        for m in members:
+            m.deadline.add_callback(member_gone)
+
+        logger.info(f"Submitting batch of {len(members)} ({'king' if is_king else 'queen'}) "
+                    f"after {time.monotonic() - batch.opened_at:.2f}s.")
+        try:
+            if len(members) == 1:
+                paths = [self.api.generate_image(members[0].image, is_king, members[0].filename, deadline)]
+            else:
+                paths = self.api.generate_batch([(m.image, m.filename) for m in members], is_king, deadline)
+        except Exception as e:
+            # lote cancelado (todos desistiram) ou de um membro so: nao ha o que tentar de novo
+            retry = len(members) > 1 and not isinstance(e, GenerationCancelled)
+            for m in members:
+                self._fail(m, _BatchFailed(str(e)) if retry else e)
+            return
+        finally:
+            for m in members:
+                m.deadline.remove_callback(member_gone)
+
+        for m, path in zip(members, paths):
+            if not m.future.done():
+                m.future.set_result(path)
+
+    def _fail(self, member: _Member, error: Exception):
+        if not member.future.done():
+            member.future.set_exception(error)
+
+    def _wait(self, member: _Member) -> str:
+        # cada membro respeita o proprio deadline, mesmo que o lote continue para os outros
+        member.deadline.add_callback(member.future.cancel)
+        try:
+            while True:
+                try:
+                    return member.future.result(timeout=member.deadline.remaining())
+                except CancelledError:
+                    member.deadline.check()
+                    raise
+                except TimeoutError:
+                    member.deadline.check()
+        finally:
+            member.deadline.remove_callback(member.future.cancel)
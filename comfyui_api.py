@@ -1,73 +1,145 @@
-import websocket
-import requests
+import threading
 import uuid
-import json
-import urllib.request
-import urllib.parse
+import concurrent.futures
 import random
 import datetime
 from PIL import Image
-import io
 import os
-import copy
+import logging
 from utils import generate_timestamped_filename
+import workflow_compiler
+from workflow_compiler import CompiledWorkflow, prompt_payload
+from comfyui_pool import ComfyUiBackendPool
+from comfyui_ws import ComfyUiEventStream
+from comfyui_transport import ComfyUiTransport
+from deadline import Deadline, DeadlineExceeded, GenerationCancelled
+import comfyui_api_utils
+import metrics
+import node_profiler
+
+logger = logging.getLogger(__name__)
 
 
 class ComfyUiAPI:
-    def __init__(self, server_address, img_temp_folder, workflow_path, node_id_ksampler, node_id_image_load, node_id_text_input):
-        self.server_address = server_address
+    def __init__(self, server_address, img_temp_folder, workflow_path, node_id_ksampler, node_id_image_load, node_id_text_input,
+                 output_node="SaveImage", output_index=0, generation_timeout: float = 300):
+        # server_address pode ser um endereco ou uma lista de backends
+        self.pool = ComfyUiBackendPool(server_address)
+        self.server_address = self.pool.backends[0].address
         self.img_temp_folder = img_temp_folder
         self.node_id_ksampler = node_id_ksampler
         self.node_id_image_load = node_id_image_load
         self.node_id_text_input = node_id_text_input
-        self.session = requests.Session()  # conexão HTTP reutilizável
-
-        # Carrega workflow uma vez e usa cópia depois
-        with open(workflow_path, "r", encoding="utf-8") as f:
-            self.workflow_template = json.load(f)
-
-    def queue_prompt(self, prompt: dict, client_id: str) -> dict:
-        payload = {"prompt": prompt, "client_id": client_id}
-        data = json.dumps(payload).encode('utf-8')
-        req = urllib.request.Request(f"http://{self.server_address}/prompt", data=data)
-        with urllib.request.urlopen(req) as response:
-            return json.loads(response.read())
-
-    def get_image(self, filename: str, subfolder: str, folder_type: str) -> bytes:
-        params = urllib.parse.urlencode({"filename": filename, "subfolder": subfolder, "type": folder_type})
-        with urllib.request.urlopen(f"http://{self.server_address}/view?{params}") as response:
-            return response.read()
-
-    def get_history(self, prompt_id: str) -> dict:
-        with urllib.request.urlopen(f"http://{self.server_address}/history/{prompt_id}") as response:
-            return json.loads(response.read())
-
-    def get_images(self, ws, prompt: dict, client_id: str) -> dict:
-        prompt_id = self.queue_prompt(prompt, client_id)['prompt_id']
-        output_images = {}
-
-        while True:
-            message_raw = ws.recv()
-            if isinstance(message_raw, str):
-                message = json.loads(message_raw)
-                if message['type'] == 'executing':
-                    data = message['data']
-                    if data['node'] is None and data['prompt_id'] == prompt_id:
-                        break
-            else:
-                continue  # skip previews (binary)
-
-        history_data = self.get_history(prompt_id)[prompt_id]
-        for node_id, node_output in history_data['outputs'].items():
-            if 'images' in node_output:
-                output_images[node_id] = [
-                    self.get_image(img['filename'], img['subfolder'], img['type'])
-                    for img in node_output['images']
-                ]
-
-        return output_images
+        self.output_node = output_node
+        self.output_index = output_index
+        self.transport = ComfyUiTransport()  # conexões HTTP reutilizáveis, compartilhadas no processo
+        self.event_streams = {}  # um WebSocket persistente por backend
+        self.event_streams_lock = threading.Lock()
+        self.history_check_interval = 30  # rede de seguranca caso uma mensagem de fim se perca
+        self.generation_timeout = generation_timeout  # prazo padrao de cada geracao (s)
+
+        # Workflow compilado uma vez (e recompilado se o arquivo mudar); por requisicao so os slots sao preenchidos
+        self.workflow_path = workflow_path
+        self.workflow_name = os.path.basename(workflow_path)  # rotulo das metricas
+        self.workflow_slots = {
+            "seed": (node_id_ksampler, "seed"),
+            "image": (node_id_image_load, "image"),
+            "text": (node_id_text_input, "text"),
+        }
+        self.compiled_workflow()
+
+    def compiled_workflow(self) -> CompiledWorkflow:
+        return workflow_compiler.registry.get(self.workflow_path, self.workflow_slots,
+                                              self.output_node, self.output_index)
+
+    @property
+    def workflow_template(self) -> dict:
+        return self.compiled_workflow().workflow
+
+    def queue_prompt(self, prompt, client_id: str, server_address: str = None) -> dict:
+        server_address = server_address or self.server_address
+        data = prompt_payload(prompt, client_id)
+        response = self.transport.post(server_address, "/prompt", data=data)
+        response.raise_for_status()
+        return response.json()
+
+    def get_history(self, prompt_id: str, server_address: str = None) -> dict:
+        server_address = server_address or self.server_address
+        response = self.transport.get(server_address, f"/history/{prompt_id}")
+        response.raise_for_status()
+        return response.json()
+
+    def get_event_stream(self, server_address: str = None) -> ComfyUiEventStream:
+        server_address = server_address or self.server_address
+        with self.event_streams_lock:
+            stream = self.event_streams.get(server_address)
+            if stream is None:
+                stream = ComfyUiEventStream(server_address,
+                                            history_fetcher=lambda pid: self.get_history(pid, server_address))
+                self.event_streams[server_address] = stream
+        return stream
+
+    def wait_prompt(self, stream: ComfyUiEventStream, prompt_id: str, server_address: str = None,
+                    deadline: Deadline = None) -> dict:
+        deadline = deadline or Deadline()
+        future = stream.register(prompt_id)
+        # cancelar o deadline acorda esta thread na hora, sem esperar o proximo timeout
+        deadline.add_callback(future.cancel)
+        try:
+            while True:
+                try:
+                    return future.result(timeout=deadline.timeout(self.history_check_interval))
+                except concurrent.futures.CancelledError:
+                    deadline.check()
+                    raise
+                except concurrent.futures.TimeoutError:
+                    deadline.check()
+                    history = self.get_history(prompt_id, server_address)
+                    if prompt_id in history:
+                        stream.resolve_from_history(prompt_id, history[prompt_id])
+        finally:
+            deadline.remove_callback(future.cancel)
+
+    def get_outputs(self, prompt, server_address: str = None, timing: dict = None, deadline: Deadline = None) -> dict:
+        """Queues the prompt, waits for it and returns its outputs (file references, not image data)."""
+        server_address = server_address or self.server_address
+        stream = self.get_event_stream(server_address)
+        # o prompt precisa ser enfileirado com o socket conectado para nao perder mensagens
+        stream.wait_connected()
+        prompt_id = self.queue_prompt(prompt, stream.client_id, server_address)['prompt_id']
 
-    def upload_file(self, file, subfolder: str = "", overwrite: bool = False) -> str:
+        try:
+            result = self.wait_prompt(stream, prompt_id, server_address, deadline)
+        except GenerationCancelled as e:
+            # devolve a GPU para quem ainda esta esperando
+            logger.info(f"Aborting prompt {prompt_id} on {server_address}: {e}")
+            stream.discard(prompt_id)
+            comfyui_api_utils.abort_prompt(prompt_id, server_address)
+            raise
+        if timing is not None:
+            if result["gpu_start"] is not None:
+                timing["gpu_start"] = result["gpu_start"]
+            timing["profile"] = result.get("profile")
+
+        outputs = result["outputs"]
+        if not outputs:
+            # nos em cache nao emitem "executed"; o historico tem tudo
+            outputs = self.get_history(prompt_id, server_address)[prompt_id]['outputs']
+        return outputs
+
+    def output_filename(self, extension: str) -> str:
+        # o sufixo aleatorio evita que geracoes no mesmo segundo se sobrescrevam
+        return generate_timestamped_filename(self.img_temp_folder, f"kingsday_{uuid.uuid4().hex[:8]}", extension)
+
+    def download_output(self, image: dict, server_address: str = None) -> str:
+        """Streams one output image ({filename, subfolder, type}) from ComfyUI straight into img_temp_folder."""
+        server_address = server_address or self.server_address
+        extension = os.path.splitext(image['filename'])[1].lstrip('.') or "png"
+        params = {"filename": image['filename'], "subfolder": image['subfolder'], "type": image['type']}
+        return self.transport.download(server_address, "/view", self.output_filename(extension), params=params)
+
+    def upload_file(self, file, subfolder: str = "", overwrite: bool = False, server_address: str = None) -> str:
+        server_address = server_address or self.server_address
         try:
             files = {"image": file}
             data = {"overwrite": "true"} if overwrite else {}
@@ -75,7 +147,7 @@ class ComfyUiAPI:
             if subfolder:
                 data["subfolder"] = subfolder
 
-            response = self.session.post(f"http://{self.server_address}/upload/image", files=files, data=data)
+            response = self.transport.post(server_address, "/upload/image", files=files, data=data)
 
             if response.status_code == 200:
                 response_data = response.json()
@@ -90,23 +162,7 @@ class ComfyUiAPI:
             print(f"[Upload Exception] {e}")
             return None
 
-    def save_image(self, images: dict) -> str:
-        for node_id, image_list in images.items():
-            for image_data in image_list:
-                image = Image.open(io.BytesIO(image_data))
-                image_filename = generate_timestamped_filename(self.img_temp_folder, "kingsday", "png")
-                image.save(image_filename, optimize=True)
-                return image_filename  # Retorna apenas a primeira imagem
-
-    def generate_image(self, image_path: str, is_king=True) -> str:
-        timing = {}
-        client_id = str(uuid.uuid4())  # Garante isolamento por requisição
-
-        start_time = datetime.datetime.now()
-        with open(image_path, "rb") as f:
-            comfyui_path_image = self.upload_file(f, "", True)
-        timing["upload"] = datetime.datetime.now()
-
+    def prepare_prompt(self, is_king=True) -> str:
         king_prompt = "king wearing a golden crown, male, 1boy"
         queen_prompt = "queen wearing a golden crown, female, 1girl, woman, diamond earings and necklaces"
 
@@ -116,28 +172,125 @@ class ComfyUiAPI:
          european red coat with white fur, renascence, inside a castle, old paintings on the walls, 
          large windows with red curtains, blurry background, photo, photorealistic, realism"""
 
-        prompt = copy.deepcopy(self.workflow_template)
-        prompt[self.node_id_ksampler]["inputs"]["seed"] = random.randint(1, 1_000_000_000)
-        prompt[self.node_id_image_load]["inputs"]["image"] = comfyui_path_image
-        prompt[self.node_id_text_input]["inputs"]["text"] = input_prompt_text
+        return input_prompt_text
+
+    def build_prompt(self, comfyui_path_image: str, is_king=True, workflow: CompiledWorkflow = None) -> str:
+        # retorna o JSON do prompt pronto para enviar
+        workflow = workflow or self.compiled_workflow()
+        return workflow.render(seed=random.randint(1, 1_000_000_000),
+                               image=comfyui_path_image,
+                               text=self.prepare_prompt(is_king))
+
+    def generate_image(self, image, is_king=True, filename: str = None, deadline: Deadline = None) -> str:
+        """
+        Generates the king/queen image for `image`, which is either a file path
+        or a binary file object (e.g. the upload stream). For file objects,
+        `filename` names the copy sent to ComfyUI; it must be unique per request.
+
+        Past `deadline` (default: `generation_timeout` from now) or once it is
+        cancelled, the prompt is removed from ComfyUI and GenerationCancelled
+        (DeadlineExceeded on timeout) is raised.
+        """
+        deadline = deadline or Deadline(self.generation_timeout)
+        return self._run_on_backend(
+            lambda server_address: self._generate_image(server_address, image, is_king, filename, deadline))
+
+    def generate_batch(self, images: list, is_king=True, deadline: Deadline = None) -> list:
+        """
+        Generates several requests with a single prompt (see
+        CompiledWorkflow.batched). `images` is a list of (image, filename)
+        pairs, as in generate_image; returns the result paths in that order.
+        """
+        deadline = deadline or Deadline(self.generation_timeout)
+        return self._run_on_backend(
+            lambda server_address: self._generate_batch(server_address, images, is_king, deadline), len(images))
+
+    def _run_on_backend(self, work, count: int = 1):
+        # work(server_address) -> (resultado, tempo de GPU); o pool aprende o tempo por imagem
+        backend = self.pool.acquire()
+        processing_time = None
+        outcome = "failure"
+        metrics.IN_FLIGHT.inc(count, backend=backend.address)
+        try:
+            result, processing_time = work(backend.address)
+            outcome = "success"
+        except DeadlineExceeded:
+            outcome = "timeout"
+            raise
+        except GenerationCancelled:
+            outcome = "cancelled"
+            raise
+        finally:
+            # quem desistiu nao conta como falha do backend
+            self.pool.release(backend, processing_time / count if processing_time is not None else None,
+                              success=outcome in ("success", "cancelled"))
+            metrics.IN_FLIGHT.dec(count, backend=backend.address)
+            metrics.GENERATIONS.inc(count, result=outcome, backend=backend.address, workflow=self.workflow_name)
+        return result
+
+    def upload_input(self, image, filename: str = None, server_address: str = None) -> str:
+        """Uploads a file path or binary file object; returns its name on the ComfyUI side."""
+        if isinstance(image, str):
+            with open(image, "rb") as f:
+                return self.upload_file(f, "", True, server_address)
+        image.seek(0)
+        upload_name = os.path.basename(filename) if filename else f"{uuid.uuid4()}.jpg"
+        return self.upload_file((upload_name, image), "", True, server_address)
+
+    def _generate_batch(self, server_address: str, images: list, is_king: bool, deadline: Deadline):
+        timing = {}
+        deadline.check()
+
+        start_time = datetime.datetime.now()
+        comfyui_paths = [self.upload_input(image, filename, server_address) for image, filename in images]
+        timing["upload"] = datetime.datetime.now()
+        deadline.check()
+
+        workflow = self.compiled_workflow().batched(len(images))
+        prompt = workflow.render_batch([{"seed": random.randint(1, 1_000_000_000), "image": path}
+                                        for path in comfyui_paths], text=self.prepare_prompt(is_king))
+
+        timing["start_execution"] = datetime.datetime.now()
+        outputs = self.get_outputs(prompt, server_address, timing, deadline)
+        timing["execution_done"] = datetime.datetime.now()
+
+        image_file_paths = [self.download_output(workflow.select_output(outputs, member), server_address)
+                            for member in range(len(images))]
+        timing["save"] = datetime.datetime.now()
+
+        metrics.observe_generation(timing, start_time, server_address, self.workflow_name)
+        # IDs com sufixo por membro: perfil separado do workflow simples
+        node_profiler.profiler.record(f"{self.workflow_name} x{len(images)}", workflow.workflow,
+                                      timing.get("profile"))
+
+        gpu_start = timing.get("gpu_start", timing["start_execution"])
+        return image_file_paths, (timing['execution_done'] - gpu_start).total_seconds()
+
+    def _generate_image(self, server_address: str, image, is_king=True, filename: str = None,
+                        deadline: Deadline = None):
+        deadline = deadline or Deadline(self.generation_timeout)
+        timing = {}
+        deadline.check()  # job cancelado enquanto esperava na fila
+
+        start_time = datetime.datetime.now()
+        comfyui_path_image = self.upload_input(image, filename, server_address)
+        timing["upload"] = datetime.datetime.now()
+        deadline.check()
+
+        workflow = self.compiled_workflow()
+        prompt = self.build_prompt(comfyui_path_image, is_king, workflow)
 
-        ws = websocket.WebSocket()
-        ws.connect(f"ws://{self.server_address}/ws?clientId={client_id}")
         timing["start_execution"] = datetime.datetime.now()
 
-        images = self.get_images(ws, prompt, client_id)
+        outputs = self.get_outputs(prompt, server_address, timing, deadline)
         timing["execution_done"] = datetime.datetime.now()
-        ws.close()
 
-        image_file_path = self.save_image(images)
+        # baixa so a imagem final declarada pelo workflow, direto para o disco
+        image_file_path = self.download_output(workflow.select_output(outputs), server_address)
         timing["save"] = datetime.datetime.now()
 
-        print("[Timing Info]")
-        print(f"Upload time:        {(timing['upload'] - start_time).total_seconds()}s")
-        print(f"Execution wait:     {(timing['start_execution'] - timing['upload']).total_seconds()}s")
-        print(f"Processing time:    {(timing['execution_done'] - timing['start_execution']).total_seconds()}s")
-        print(f"Saving time:        {(timing['save'] - timing['execution_done']).total_seconds()}s")
-        print(f"Total:              {(timing['save'] - start_time).total_seconds()}s")
+        metrics.observe_generation(timing, start_time, server_address, self.workflow_name)
+        node_profiler.profiler.record(self.workflow_name, workflow.workflow, timing.get("profile"))
         #watermark_file_path = 'static/assets/logo_amstel.png'
 
         print(f"[DEBUG] Saved image path: {image_file_path}")
@@ -147,7 +300,8 @@ class ComfyUiAPI:
         #    raise FileNotFoundError(f"Marca d'água não encontrada em: {watermark_file_path}")
 
         #self.add_watermark_image(image_file_path, watermark_file_path)
-        return image_file_path
+        gpu_start = timing.get("gpu_start", timing["start_execution"])
+        return image_file_path, (timing['execution_done'] - gpu_start).total_seconds()
 
     def add_watermark_image(self, base_image_path: str, watermark_path: str) -> None:
         base_image = Image.open(base_image_path).convert("RGBA")
@@ -0,0 +1,271 @@
+import asyncio
+import threading
+import datetime
+import os
+import uuid
+import logging
+
+import aiohttp
+
+import parameters as param
+import comfyui_api
+import metrics
+import node_profiler
+from comfyui_transport import ComfyUiTransport
+from comfyui_ws import ComfyUiEventStream
+from deadline import Deadline, DeadlineExceeded, GenerationCancelled
+from workflow_compiler import prompt_payload
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncComfyUiAPI:
+    """
+    asyncio version of ComfyUiAPI: upload, queue, wait, download and save are
+    coroutines, so a single event loop runs many generations at once and a
+    generation can be cancelled like any other task.
+
+    Backend routing, prompt building and the per-backend event streams are
+    shared with the synchronous client, so both behave the same way.
+    """
+
+    def __init__(self, server_address, img_temp_folder, workflow_path, node_id_ksampler, node_id_image_load, node_id_text_input,
+                 output_node="SaveImage", output_index=0, generation_timeout: float = 300):
+        self.api = comfyui_api.ComfyUiAPI(server_address, img_temp_folder, workflow_path,
+                                          node_id_ksampler, node_id_image_load, node_id_text_input,
+                                          output_node, output_index, generation_timeout)
+        self.session = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit_per_host=param.COMFYUI_POOL_MAXSIZE)
+            timeout = aiohttp.ClientTimeout(sock_connect=param.COMFYUI_CONNECT_TIMEOUT,
+                                            sock_read=param.COMFYUI_READ_TIMEOUT)
+            # o cookie do ALB e passado por chamada, nunca guardado na sessao
+            self.session = aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                                 cookie_jar=aiohttp.DummyCookieJar())
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+    async def queue_prompt(self, prompt, client_id: str, server_address: str) -> dict:
+        async with self._get_session().post(ComfyUiTransport.url(server_address, "/prompt"),
+                                            data=prompt_payload(prompt, client_id)) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    async def get_history(self, prompt_id: str, server_address: str) -> dict:
+        async with self._get_session().get(ComfyUiTransport.url(server_address, f"/history/{prompt_id}")) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    async def delete_from_queue(self, prompt_id: str, server_address: str):
+        async with self._get_session().post(ComfyUiTransport.url(server_address, "/queue"),
+                                            json={"delete": [prompt_id]}) as response:
+            response.raise_for_status()
+
+    async def abort_prompt(self, prompt_id: str, server_address: str):
+        """Removes the prompt from the queue, or interrupts it if it is already running."""
+        session = self._get_session()
+        await self.delete_from_queue(prompt_id, server_address)
+        async with session.get(ComfyUiTransport.url(server_address, "/queue")) as response:
+            queue = await response.json()
+        if any(item[1] == prompt_id for item in queue.get("queue_running", [])):
+            async with session.post(ComfyUiTransport.url(server_address, "/interrupt"),
+                                    json={"prompt_id": prompt_id}) as response:
+                response.raise_for_status()
+
+    async def upload_file(self, file_data: bytes, filename: str, subfolder: str = "", overwrite: bool = False,
+                          server_address: str = None) -> str:
+        form = aiohttp.FormData()
+        form.add_field("image", file_data, filename=filename)
+        if overwrite:
+            form.add_field("overwrite", "true")
+        if subfolder:
+            form.add_field("subfolder", subfolder)
+
+        try:
+            async with self._get_session().post(ComfyUiTransport.url(server_address, "/upload/image"),
+                                                data=form) as response:
+                if response.status == 200:
+                    response_data = await response.json()
+                    path = response_data["name"]
+                    if response_data.get("subfolder"):
+                        path = f"{response_data['subfolder']}/{path}"
+                    return path
+                else:
+                    logger.warning(f"[Upload Error] {response.status} - {response.reason}")
+                    return None
+        except aiohttp.ClientError as e:
+            logger.warning(f"[Upload Exception] {e}")
+            return None
+
+    async def wait_prompt(self, stream: ComfyUiEventStream, prompt_id: str, server_address: str,
+                          deadline: Deadline = None) -> dict:
+        deadline = deadline or Deadline()
+        shared = stream.register(prompt_id)
+        future = asyncio.wrap_future(shared)
+        # cancelar o deadline (de outra thread) cancela a Future e acorda a corrotina
+        deadline.add_callback(shared.cancel)
+        try:
+            while True:
+                try:
+                    # shield: o timeout nao pode cancelar a Future compartilhada com o socket
+                    return await asyncio.wait_for(asyncio.shield(future),
+                                                  deadline.timeout(self.api.history_check_interval))
+                except asyncio.TimeoutError:
+                    deadline.check()
+                    history = await self.get_history(prompt_id, server_address)
+                    if prompt_id in history:
+                        stream.resolve_from_history(prompt_id, history[prompt_id])
+                except asyncio.CancelledError:
+                    if deadline.cancelled:
+                        raise GenerationCancelled(deadline.reason)
+                    raise
+        finally:
+            deadline.remove_callback(shared.cancel)
+
+    async def get_outputs(self, prompt, server_address: str, timing: dict = None, deadline: Deadline = None) -> dict:
+        loop = asyncio.get_running_loop()
+        stream = self.api.get_event_stream(server_address)
+        await loop.run_in_executor(None, stream.wait_connected)
+        prompt_id = (await self.queue_prompt(prompt, stream.client_id, server_address))['prompt_id']
+
+        try:
+            result = await self.wait_prompt(stream, prompt_id, server_address, deadline)
+        except (asyncio.CancelledError, GenerationCancelled) as e:
+            # devolve a GPU para quem ainda esta esperando
+            logger.info(f"Aborting prompt {prompt_id} on {server_address}: {e!r}")
+            stream.discard(prompt_id)
+            try:
+                await self.abort_prompt(prompt_id, server_address)
+            except aiohttp.ClientError as abort_error:
+                logger.warning(f"Could not abort prompt {prompt_id}: {abort_error}")
+            raise
+
+        if timing is not None:
+            if result["gpu_start"] is not None:
+                timing["gpu_start"] = result["gpu_start"]
+            timing["profile"] = result.get("profile")
+
+        outputs = result["outputs"]
+        if not outputs:
+            outputs = (await self.get_history(prompt_id, server_address))[prompt_id]['outputs']
+        return outputs
+
+    async def download_output(self, image: dict, server_address: str) -> str:
+        loop = asyncio.get_running_loop()
+        extension = os.path.splitext(image['filename'])[1].lstrip('.') or "png"
+        destination = self.api.output_filename(extension)
+        partial = f"{destination}.part"
+        params = {"filename": image['filename'], "subfolder": image['subfolder'], "type": image['type']}
+
+        try:
+            async with self._get_session().get(ComfyUiTransport.url(server_address, "/view"),
+                                               params=params) as response:
+                response.raise_for_status()
+                with open(partial, "wb") as f:
+                    async for chunk in response.content.iter_chunked(64 * 1024):
+                        await loop.run_in_executor(None, f.write, chunk)
+            os.replace(partial, destination)
+        except BaseException:
+            # inclusive CancelledError: nao deixa o .part para tras
+            try:
+                os.remove(partial)
+            except OSError:
+                pass
+            raise
+        return destination
+
+    async def generate_image(self, image, is_king=True, filename: str = None, deadline: Deadline = None) -> str:
+        deadline = deadline or Deadline(self.api.generation_timeout)
+        backend = self.api.pool.acquire()
+        processing_time = None
+        outcome = "failure"
+        metrics.IN_FLIGHT.inc(backend=backend.address)
+        try:
+            image_file_path, processing_time = await self._generate_image(backend.address, image, is_king, filename,
+                                                                          deadline)
+            outcome = "success"
+        except DeadlineExceeded:
+            outcome = "timeout"
+            raise
+        except (GenerationCancelled, asyncio.CancelledError):
+            outcome = "cancelled"
+            raise
+        finally:
+            # quem desistiu nao conta como falha do backend
+            self.api.pool.release(backend, processing_time, success=outcome in ("success", "cancelled"))
+            metrics.IN_FLIGHT.dec(backend=backend.address)
+            metrics.GENERATIONS.inc(result=outcome, backend=backend.address, workflow=self.api.workflow_name)
+        return image_file_path
+
+    async def _generate_image(self, server_address: str, image, is_king=True, filename: str = None,
+                              deadline: Deadline = None):
+        loop = asyncio.get_running_loop()
+        deadline = deadline or Deadline(self.api.generation_timeout)
+        timing = {}
+        deadline.check()  # job cancelado enquanto esperava na fila
+
+        start_time = datetime.datetime.now()
+        if isinstance(image, str):
+            filename = image
+        file_data = await loop.run_in_executor(None, _read_image, image)
+        upload_name = os.path.basename(filename) if filename else f"{uuid.uuid4()}.jpg"
+        comfyui_path_image = await self.upload_file(file_data, upload_name, "", True, server_address)
+        timing["upload"] = datetime.datetime.now()
+        deadline.check()
+
+        workflow = self.api.compiled_workflow()
+        prompt = self.api.build_prompt(comfyui_path_image, is_king, workflow)
+
+        timing["start_execution"] = datetime.datetime.now()
+        outputs = await self.get_outputs(prompt, server_address, timing, deadline)
+        timing["execution_done"] = datetime.datetime.now()
+
+        image_file_path = await self.download_output(workflow.select_output(outputs), server_address)
+        timing["save"] = datetime.datetime.now()
+
+        metrics.observe_generation(timing, start_time, server_address, self.api.workflow_name)
+        node_profiler.profiler.record(self.api.workflow_name, workflow.workflow, timing.get("profile"))
+        logger.debug(f"Generated {filename} => {image_file_path} ({server_address})")
+
+        assert image_file_path is not None, "Erro: Caminho da imagem gerada está vazio!"
+
+        gpu_start = timing.get("gpu_start", timing["start_execution"])
+        return image_file_path, (timing['execution_done'] - gpu_start).total_seconds()
+
+
+def _read_image(image) -> bytes:
+    if isinstance(image, str):
+        with open(image, "rb") as f:
+            return f.read()
+    image.seek(0)
+    return image.read()
+
+
+class ComfyUiAPI:
+    """
+    Blocking facade over AsyncComfyUiAPI with the same interface as
+    comfyui_api.ComfyUiAPI, so the Flask apps can switch by changing the
+    import. The event loop runs on a background thread; `generate_image`
+    only blocks the calling thread, and `submit` returns a Future instead.
+    """
+
+    def __init__(self, server_address, img_temp_folder, workflow_path, node_id_ksampler, node_id_image_load, node_id_text_input,
+                 output_node="SaveImage", output_index=0, generation_timeout: float = 300):
+        self.async_api = AsyncComfyUiAPI(server_address, img_temp_folder, workflow_path,
+                                         node_id_ksampler, node_id_image_load, node_id_text_input,
+                                         output_node, output_index, generation_timeout)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="comfyui-async-loop", daemon=True)
+        self.thread.start()
+
+    def submit(self, image, is_king=True, filename: str = None, deadline: Deadline = None):
+        return asyncio.run_coroutine_threadsafe(self.async_api.generate_image(image, is_king, filename, deadline),
+                                                self.loop)
+
+    def generate_image(self, image, is_king=True, filename: str = None, deadline: Deadline = None) -> str:
+        return self.submit(image, is_king, filename, deadline).result()
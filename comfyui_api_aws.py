@@ -1,78 +1,70 @@
-import websocket
-import requests
 import uuid
-import json
-import urllib.request
-import urllib.parse
+import concurrent.futures
 import random
 import datetime
 from PIL import Image
-import io
 import os
-import copy
 from utils import generate_timestamped_filename
+import workflow_compiler
+from workflow_compiler import CompiledWorkflow, prompt_payload
 import comfyui_api_utils
-import time
+from comfyui_transport import ComfyUiTransport
+from comfyui_completion import AlbCompletionEngine
+from deadline import Deadline, DeadlineExceeded, GenerationCancelled
+import metrics
+import node_profiler
 import logging
 
 logger = logging.getLogger(__name__)
 
 
 class ComfyUiAPI:
-    def __init__(self, server_address, img_temp_folder, workflow_path, node_id_ksampler, node_id_image_load, node_id_text_input):
+    def __init__(self, server_address, img_temp_folder, workflow_path, node_id_ksampler, node_id_image_load, node_id_text_input,
+                 output_node="SaveImage", output_index=0, generation_timeout: float = 300,
+                 single_target: bool = False):
         self.server_address = server_address
         self.img_temp_folder = img_temp_folder
         self.node_id_ksampler = node_id_ksampler
         self.node_id_image_load = node_id_image_load
         self.node_id_text_input = node_id_text_input
-        self.session = requests.Session()  # conexão HTTP reutilizável
-
-        # Carrega workflow uma vez e usa cópia depois
-        with open(workflow_path, "r", encoding="utf-8") as f:
-            self.workflow_template = json.load(f)
-
-    def queue_prompt(self, prompt: dict, client_id: str) -> dict:
-        payload = {"prompt": prompt, "client_id": client_id}
-        data = json.dumps(payload).encode('utf-8')
-        req = urllib.request.Request(f"http://{self.server_address}/prompt", data=data)
-        with urllib.request.urlopen(req) as response:
-            return json.loads(response.read())
-
-    def get_image(self, filename: str, subfolder: str, folder_type: str) -> bytes:
-        params = urllib.parse.urlencode({"filename": filename, "subfolder": subfolder, "type": folder_type})
-        with urllib.request.urlopen(f"http://{self.server_address}/view?{params}") as response:
-            return response.read()
+        self.output_node = output_node
+        self.output_index = output_index
+        self.transport = ComfyUiTransport()  # conexões HTTP reutilizáveis, compartilhadas no processo
+        # single_target: direto no EC2 (ou ALB com um alvo), os sockets sem cookie AWSALB tambem valem
+        self.completion = AlbCompletionEngine(server_address, single_target=single_target)
+        self.generation_timeout = generation_timeout  # prazo padrao de cada geracao (s)
+
+        # Workflow compilado uma vez (e recompilado se o arquivo mudar); por requisicao so os slots sao preenchidos
+        self.workflow_path = workflow_path
+        self.workflow_name = os.path.basename(workflow_path)  # rotulo das metricas
+        self.workflow_slots = {
+            "seed": (node_id_ksampler, "seed"),
+            "image": (node_id_image_load, "image"),
+            "text": (node_id_text_input, "text"),
+        }
+        self.compiled_workflow()
+
+    def compiled_workflow(self) -> CompiledWorkflow:
+        return workflow_compiler.registry.get(self.workflow_path, self.workflow_slots,
+                                              self.output_node, self.output_index)
+
+    @property
+    def workflow_template(self) -> dict:
+        return self.compiled_workflow().workflow
+
+    def queue_prompt(self, prompt, client_id: str) -> dict:
+        data = prompt_payload(prompt, client_id)
+        response = self.transport.post(self.server_address, "/prompt", data=data)
+        response.raise_for_status()
+        return response.json()
 
     def get_history(self, prompt_id: str) -> dict:
-        with urllib.request.urlopen(f"http://{self.server_address}/history/{prompt_id}") as response:
-            return json.loads(response.read())
-
-    def get_images_old(self, ws, prompt: dict, client_id: str) -> dict:
-        prompt_id = self.queue_prompt(prompt, client_id)['prompt_id']
-        output_images = {}
-
-        while True:
-            message_raw = ws.recv()
-            if isinstance(message_raw, str):
-                message = json.loads(message_raw)
-                if message['type'] == 'executing':
-                    data = message['data']
-                    if data['node'] is None and data['prompt_id'] == prompt_id:
-                        break
-            else:
-                continue  # skip previews (binary)
+        response = self.transport.get(self.server_address, f"/history/{prompt_id}")
+        response.raise_for_status()
+        return response.json()
 
-        history_data = self.get_history(prompt_id)[prompt_id]
-        for node_id, node_output in history_data['outputs'].items():
-            if 'images' in node_output:
-                output_images[node_id] = [
-                    self.get_image(img['filename'], img['subfolder'], img['type'])
-                    for img in node_output['images']
-                ]
-
-        return output_images
-
-    def upload_file(self, file, subfolder: str = "", overwrite: bool = False) -> str:
+    def upload_file(self, file, subfolder: str = "", overwrite: bool = False, aws_alb_cookie: str = None) -> tuple:
+        """Uploads through the ALB with `aws_alb_cookie`; returns (path or None, cookie of the node that got it)."""
         try:
             files = {"image": file}
             data = {"overwrite": "true"} if overwrite else {}
@@ -80,28 +72,22 @@ class ComfyUiAPI:
             if subfolder:
                 data["subfolder"] = subfolder
 
-            response = self.session.post(f"http://{self.server_address}/upload/image", files=files, data=data)
+            response = self.transport.post(self.server_address, "/upload/image", files=files, data=data,
+                                           cookie=aws_alb_cookie)
+            aws_alb_cookie = comfyui_api_utils.alb_cookie(response, aws_alb_cookie)
 
             if response.status_code == 200:
                 response_data = response.json()
                 path = response_data["name"]
                 if response_data.get("subfolder"):
                     path = f"{response_data['subfolder']}/{path}"
-                return path
+                return path, aws_alb_cookie
             else:
                 logger.warning(f"[Upload Error] {response.status_code} - {response.reason}")
-                return None
+                return None, aws_alb_cookie
         except Exception as e:
             logger.warning(f"[Upload Exception] {e}")
-            return None
-
-    def save_image(self, images: dict) -> str:
-        for node_id, image_list in images.items():
-            for image_data in image_list:
-                with Image.open(io.BytesIO(image_data)) as image:
-                    image_filename = generate_timestamped_filename(self.img_temp_folder, "kingsday", "png")
-                    image.save(image_filename, optimize=True)
-                    return image_filename  # Retorna apenas a primeira imagem
+            return None, aws_alb_cookie
 
     def prepare_prompt(self, is_king=True):
         king_prompt = "king wearing a golden crown, male, 1boy"
@@ -115,71 +101,125 @@ class ComfyUiAPI:
 
         return input_prompt_text
 
-    def get_images(self, prompt, client_id, server_address):
-        prompt_id, aws_alb_cookie = comfyui_api_utils.queue_prompt(prompt, client_id, server_address)
-        output_images = {}
+    def wait_prompt(self, future, deadline: Deadline) -> dict:
+        # cancelar o deadline acorda esta thread na hora
+        deadline.add_callback(future.cancel)
+        try:
+            while True:
+                try:
+                    return future.result(timeout=deadline.remaining())
+                except concurrent.futures.CancelledError:
+                    deadline.check()
+                    raise
+                except concurrent.futures.TimeoutError:
+                    deadline.check()
+        finally:
+            deadline.remove_callback(future.cancel)
+
+    def get_outputs(self, prompt, server_address, timing: dict = None, deadline: Deadline = None, route: tuple = None):
+        """
+        Queues the prompt on `route` (from AlbCompletionEngine.route), waits for it
+        and returns (outputs, prompt_id, aws_alb_cookie).
+        """
+        deadline = deadline or Deadline(self.generation_timeout)
+        prompt_id, aws_alb_cookie, future = self.completion.submit(prompt, route)
 
         logger.debug("Generation started.")
-        while True:
-            history = comfyui_api_utils.get_history(prompt_id, server_address, aws_alb_cookie)
-            if len(history) == 0:
-                logger.debug("Generation not ready, sleep 1s ...")
-                time.sleep(1)
-                continue
-            else:
-                logger.debug("Generation finished.")
-                break
-
-        history = history[prompt_id]
-        for node_id in history['outputs']:
-            node_output = history['outputs'][node_id]
-            if 'images' in node_output and node_output['images'][0]['type'] == 'output':
-                images_output = []
-                for image in node_output['images']:
-                    image_data = comfyui_api_utils.get_image(image['filename'], image['subfolder'], image['type'],
-                                                             server_address, aws_alb_cookie)
-                    images_output.append(image_data)
-                output_images[node_id] = images_output
-        return output_images, prompt_id
-
-    def generate_image(self, image_path: str, is_king=True) -> str:
+        try:
+            result = self.wait_prompt(future, deadline)
+        except GenerationCancelled as e:
+            # o cookie leva o delete/interrupt ao mesmo no que recebeu o prompt
+            logger.info(f"Aborting prompt {prompt_id}: {e}")
+            future.cancel()
+            self.completion.cancel(prompt_id)
+            comfyui_api_utils.abort_prompt(prompt_id, server_address, aws_alb_cookie)
+            raise
+        logger.debug("Generation finished.")
+        if result["gpu_start"] is not None and timing is not None:
+            timing["gpu_start"] = result["gpu_start"]
+        if timing is not None:
+            timing["profile"] = result.get("profile")
+
+        outputs = result["outputs"]
+        if not outputs:
+            outputs = comfyui_api_utils.get_history(prompt_id, server_address, aws_alb_cookie)[prompt_id]['outputs']
+        return outputs, prompt_id, aws_alb_cookie
+
+    def output_filename(self, extension: str) -> str:
+        # o sufixo aleatorio evita que geracoes no mesmo segundo se sobrescrevam
+        return generate_timestamped_filename(self.img_temp_folder, f"kingsday_{uuid.uuid4().hex[:8]}", extension)
+
+    def download_output(self, image: dict, server_address: str, aws_alb_cookie: str) -> str:
+        """Streams one output image from the node that ran the prompt straight into img_temp_folder."""
+        extension = os.path.splitext(image['filename'])[1].lstrip('.') or "png"
+        destination = self.output_filename(extension)
+        return comfyui_api_utils.download_image(image['filename'], image['subfolder'], image['type'],
+                                                server_address, aws_alb_cookie, destination)
+
+    def generate_image(self, image_path, is_king=True, filename: str = None, deadline: Deadline = None) -> str:
+        deadline = deadline or Deadline(self.generation_timeout)
+        outcome = "failure"
+        metrics.IN_FLIGHT.inc(backend=self.server_address)
+        try:
+            image_file_path = self._generate_image(image_path, is_king, filename, deadline)
+            outcome = "success"
+        except DeadlineExceeded:
+            outcome = "timeout"
+            raise
+        except GenerationCancelled:
+            outcome = "cancelled"
+            raise
+        finally:
+            metrics.IN_FLIGHT.dec(backend=self.server_address)
+            metrics.GENERATIONS.inc(result=outcome, backend=self.server_address, workflow=self.workflow_name)
+        return image_file_path
+
+    def _generate_image(self, image_path, is_king=True, filename: str = None, deadline: Deadline = None) -> str:
+        deadline = deadline or Deadline(self.generation_timeout)
         timing = {}
+        deadline.check()  # job cancelado enquanto esperava na fila
         client_id = str(uuid.uuid4())  # Garante isolamento por requisição
 
         start_time = datetime.datetime.now()
-        with open(image_path, "rb") as f:
-            #comfyui_path_image = self.upload_file(f, "", True)
-            comfyui_path_image = comfyui_api_utils.upload_image(image_path=image_path,
-                                                                server_address=self.server_address)
+        # a imagem vai com o mesmo cookie AWSALB do prompt: sem storage compartilhado, so esse no a tem
+        stream, aws_alb_cookie = self.completion.route()
+        if isinstance(image_path, str):
+            with open(image_path, "rb") as f:
+                comfyui_path_image, aws_alb_cookie = self.upload_file(f, "", True, aws_alb_cookie)
+        else:
+            # objeto de arquivo (stream do upload): envia direto, sem passar pelo disco
+            image_path.seek(0)
+            upload_name = os.path.basename(filename) if filename else f"{client_id}.jpg"
+            comfyui_path_image, aws_alb_cookie = self.upload_file((upload_name, image_path), "", True, aws_alb_cookie)
+            image_path = filename
 
         timing["upload"] = datetime.datetime.now()
+        deadline.check()
 
         input_prompt_text = self.prepare_prompt(is_king)
 
-        prompt = copy.deepcopy(self.workflow_template)
-        prompt[self.node_id_ksampler]["inputs"]["seed"] = random.randint(1, 1_000_000_000)
-        prompt[self.node_id_image_load]["inputs"]["image"] = comfyui_path_image
-        prompt[self.node_id_text_input]["inputs"]["text"] = input_prompt_text
+        workflow = self.compiled_workflow()
+        prompt = workflow.render(seed=random.randint(1, 1_000_000_000),
+                                 image=comfyui_path_image,
+                                 text=input_prompt_text)
 
         #ws = websocket.WebSocket()
         #ws.connect(f"ws://{self.server_address}/ws?clientId={client_id}")
         timing["start_execution"] = datetime.datetime.now()
 
-        images, prompt_id = self.get_images(prompt, client_id, server_address=self.server_address)
+        outputs, prompt_id, aws_alb_cookie = self.get_outputs(prompt, self.server_address, timing, deadline,
+                                                              (stream, aws_alb_cookie))
         #images = self.get_images(ws, prompt, client_id)
 
         timing["execution_done"] = datetime.datetime.now()
         #ws.close()
 
-        image_file_path = self.save_image(images)
+        # baixa so a imagem final declarada pelo workflow (um /view pelo ALB), direto para o disco
+        image_file_path = self.download_output(workflow.select_output(outputs), self.server_address, aws_alb_cookie)
         timing["save"] = datetime.datetime.now()
 
-        logger.info(f"Timing Info for image: {image_path} => {image_file_path}")
-        logger.info(f"Upload time:        {(timing['upload'] - start_time).total_seconds()}s")
-        logger.info(f"Execution wait:     {(timing['start_execution'] - timing['upload']).total_seconds()}s")
-        logger.info(f"Processing time:    {(timing['execution_done'] - timing['start_execution']).total_seconds()}s")
-        logger.info(f"Saving time:        {(timing['save'] - timing['execution_done']).total_seconds()}s")
-        logger.info(f"Total:              {(timing['save'] - start_time).total_seconds()}s")
+        metrics.observe_generation(timing, start_time, self.server_address, self.workflow_name)
+        node_profiler.profiler.record(self.workflow_name, workflow.workflow, timing.get("profile"))
         #watermark_file_path = 'static/assets/logo_amstel.png'
 
         logger.debug(f"Saved image path: {image_file_path}")
@@ -225,7 +265,8 @@ if __name__ == '__main__':
         workflow_path=param.WORKFLOW_PATH,
         node_id_ksampler=param.WORKFLOW_NODE_ID_KSAMPLER,
         node_id_image_load=param.WORKFLOW_NODE_ID_IMAGE_LOAD,
-        node_id_text_input=param.WORKFLOW_NODE_ID_TEXT_INPUT
+        node_id_text_input=param.WORKFLOW_NODE_ID_TEXT_INPUT,
+        single_target=True
     )
 
     #input_image = r"C:\Users\Win 11\Downloads\maekiko.png"
@@ -1,32 +1,35 @@
-import requests
-import json
-import urllib
 import pprint
-import sys
+
+from comfyui_transport import ComfyUiTransport
+from workflow_compiler import prompt_payload
 
 
 
 # Send prompt request to server and get prompt_id and AWSALB cookie
-def queue_prompt(prompt, client_id, server_address):
-    p = {"prompt": prompt, "client_id": client_id}
-    data = json.dumps(p).encode('utf-8')
-    response = requests.post("{}/prompt".format(server_address), data=data)
+# Passing aws_alb_cookie pins the prompt to the node that issued the cookie
+def queue_prompt(prompt, client_id, server_address, aws_alb_cookie=None):
+    data = prompt_payload(prompt, client_id)
+    response = ComfyUiTransport().post(server_address, "/prompt", data=data, cookie=aws_alb_cookie)
     if response.status_code != 200:
         print("Error: {}".format(response.text))
-        sys.exit(1)
-    if 'Set-Cookie' not in response.headers:
+    # erro normal: quem chama pode ser uma thread de job, que nao pode derrubar o processo
+    response.raise_for_status()
+    if 'Set-Cookie' not in response.headers and aws_alb_cookie is None:
         print("No ALB, test directly to EC2.")
-        aws_alb_cookie = None
-    else:
-        aws_alb_cookie = response.headers['Set-Cookie'].split(';')[0]
     prompt_id = response.json()['prompt_id']
-    return prompt_id, aws_alb_cookie
+    return prompt_id, alb_cookie(response, aws_alb_cookie)
+
+
+# AWSALB cookie set by the response, or the one the request was sent with
+def alb_cookie(response, aws_alb_cookie=None):
+    if 'Set-Cookie' not in response.headers:
+        return aws_alb_cookie
+    return response.headers['Set-Cookie'].split(';')[0]
 
 # Check if input image is ready
 def check_input_image_ready(filename, server_address):
     data = {"filename": filename, "subfolder": "", "type": "input"}
-    url_values = urllib.parse.urlencode(data)
-    response = requests.get("{}/view?{}".format(server_address, url_values))
+    response = ComfyUiTransport().get(server_address, "/view", params=data)
     if response.status_code == 200:
         print("Input image {} is ready, skip upload.".format(filename))
         return True
@@ -38,7 +41,7 @@ def check_input_image_ready(filename, server_address):
 def upload_image(image_path, server_address):
     with open(image_path, "rb") as f:
         files = {"image": f}
-        response = requests.post("{}/upload/image".format(server_address), files=files)
+        response = ComfyUiTransport().post(server_address, "/upload/image", files=files)
 
     if response.status_code != 200:
         print(f"[Upload Error] {response.status_code} - {response.reason}")
@@ -51,20 +54,38 @@ def upload_image(image_path, server_address):
     return path
 
 
-# Get image from server
-def get_image(filename, subfolder, folder_type, server_address, aws_alb_cookie):
+# Stream image from server straight into a local file
+def download_image(filename, subfolder, folder_type, server_address, aws_alb_cookie, destination):
     data = {"filename": filename, "subfolder": subfolder, "type": folder_type}
-    url_values = urllib.parse.urlencode(data)
-    response = requests.get("{}/view?{}".format(server_address, url_values), headers={"Cookie": aws_alb_cookie})
-    return response.content
+    return ComfyUiTransport().download(server_address, "/view", destination, cookie=aws_alb_cookie, params=data)
 
 # Get invocation history from server
 def get_history(prompt_id, server_address, aws_alb_cookie):
-    response = requests.get("{}/history/{}".format(server_address, prompt_id), headers={"Cookie": aws_alb_cookie})
+    response = ComfyUiTransport().get(server_address, "/history/{}".format(prompt_id), cookie=aws_alb_cookie)
     return response.json()
 
+# Get the most recent entries of the invocation history in a single request
+def get_recent_history(server_address, aws_alb_cookie, max_items=64):
+    response = ComfyUiTransport().get(server_address, "/history", params={"max_items": max_items}, cookie=aws_alb_cookie)
+    return response.json()
+
+# Remove a prompt from the server: deleted from the queue if still pending,
+# interrupted if already running (recent ComfyUI only interrupts when prompt_id matches)
+def abort_prompt(prompt_id, server_address, aws_alb_cookie=None):
+    transport = ComfyUiTransport()
+    try:
+        transport.post(server_address, "/queue", json={"delete": [prompt_id]}, cookie=aws_alb_cookie)
+        queue = transport.get(server_address, "/queue", cookie=aws_alb_cookie).json()
+        if any(item[1] == prompt_id for item in queue.get("queue_running", [])):
+            transport.post(server_address, "/interrupt", json={"prompt_id": prompt_id}, cookie=aws_alb_cookie)
+            return "interrupted"
+        return "deleted"
+    except Exception as e:
+        print(f"[Abort Error] {prompt_id}: {e}")
+        return None
+
 def get_queue_status(prompt_id,server_address):
-    response = requests.get("{}/queue".format(server_address))
+    response = ComfyUiTransport().get(server_address, "/queue")
     pprint.pprint(response.json())
 
 if __name__ == "__main__":
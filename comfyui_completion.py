@@ -0,0 +1,206 @@
+import datetime
+import threading
+import time
+import uuid
+import logging
+from concurrent.futures import Future
+
+import comfyui_api_utils
+from comfyui_ws import ComfyUiEventStream
+
+logger = logging.getLogger(__name__)
+
+
+class _PolledPrompt:
+    def __init__(self, prompt_id: str, aws_alb_cookie: str, future: Future, first_check: float, interval: float,
+                 stream: ComfyUiEventStream = None):
+        self.prompt_id = prompt_id
+        self.aws_alb_cookie = aws_alb_cookie
+        self.future = future
+        self.stream = stream
+        self.submitted_at = time.time()
+        self.checked_at = self.submitted_at  # ultima consulta que ainda nao achou o prompt
+        self.next_check = self.submitted_at + first_check
+        self.interval = interval
+
+
+class AlbCompletionEngine:
+    """
+    Detects when prompts sent through the AWS ALB are finished.
+
+    It keeps `num_streams` sticky progress WebSockets. Each one has its own
+    clientId and the AWSALB cookie of the node it landed on. A prompt is
+    queued with the cookie and clientId of the least busy connected stream,
+    so its completion message arrives on that socket.
+
+    If no stream is connected, the prompt is queued as before and a single
+    poller thread checks /history for it. Polling starts when the prompt
+    should be almost done, based on the measured processing time, and then
+    backs off. Outstanding prompts that share a cookie are checked with one
+    /history request. Polled prompts feed the estimate too, from the
+    execution timestamps ComfyUI keeps in /history.
+
+    The poller also re-checks prompts that have a WebSocket, with a longer
+    delay, in case a completion message is lost.
+
+    Parameters:
+    - server_address (str): ALB URL, e.g. http://comfyui.example.com.
+    - num_streams (int): Sticky WebSockets to keep open (0 disables them).
+    - initial_processing_time (float): Processing time estimate (s) until one is measured.
+    - single_target (bool): Only one ComfyUI behind the address (no ALB, or one target):
+      streams without an AWSALB cookie can be used too.
+    """
+
+    def __init__(self, server_address: str, num_streams: int = 2, initial_processing_time: float = 15.0,
+                 min_interval: float = 0.1, max_interval: float = 2.0, ewma_alpha: float = 0.2,
+                 single_target: bool = False):
+        self.server_address = server_address
+        self.single_target = single_target
+        self.processing_time = initial_processing_time
+        self.measured = False  # ate a primeira medida o valor inicial e so um chute
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.ewma_alpha = ewma_alpha
+        self.polled = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.streams = []
+        for _ in range(num_streams):
+            stream = ComfyUiEventStream(server_address, sticky=True)
+            stream.history_fetcher = self._history_fetcher(stream)
+            self.streams.append(stream)
+        self.poller = threading.Thread(target=self._poll_loop, name="comfyui-alb-poller", daemon=True)
+        self.poller.start()
+
+    def route(self) -> tuple:
+        """
+        Picks where the next prompt goes: (stream or None, aws_alb_cookie). Send the
+        input uploads with this cookie and pass the route to `submit`, so the image
+        and the prompt land on the same node.
+        """
+        stream = self._pick_stream()
+        return stream, stream.cookie if stream is not None else None
+
+    def submit(self, prompt, route: tuple = None):
+        """Queues the prompt on `route` (default: a new one) and returns (prompt_id, aws_alb_cookie, future)."""
+        stream, aws_alb_cookie = route or self.route()
+        if stream is not None:
+            prompt_id, aws_alb_cookie = comfyui_api_utils.queue_prompt(prompt, stream.client_id, self.server_address,
+                                                                       aws_alb_cookie)
+            future = stream.register(prompt_id)
+            future.add_done_callback(self._measure_streamed)
+            # rede de seguranca: so consulta o historico se o socket nao avisar bem depois do esperado
+            self._track(prompt_id, aws_alb_cookie, future, first_check=3 * self.processing_time + 5,
+                        interval=self.max_interval, stream=stream)
+        else:
+            prompt_id, aws_alb_cookie = comfyui_api_utils.queue_prompt(prompt, str(uuid.uuid4()), self.server_address,
+                                                                       aws_alb_cookie)
+            future = Future()
+            # sem medida ainda, consulta logo e vai espacando; depois comeca perto do fim esperado
+            first_check = 0.8 * self.processing_time if self.measured else self.min_interval
+            self._track(prompt_id, aws_alb_cookie, future, first_check=first_check,
+                        interval=max(self.min_interval, 0.02 * self.processing_time))
+        return prompt_id, aws_alb_cookie, future
+
+    def cancel(self, prompt_id: str):
+        """Stops waiting for an aborted prompt: no completion message will ever arrive for it."""
+        self._untrack(prompt_id)
+        # a Future pode ja ter sido cancelada (e a entrada removida): descarta em todos os sockets
+        for stream in self.streams:
+            stream.discard(prompt_id)
+
+    def record_processing_time(self, seconds: float):
+        if not self.measured:
+            self.processing_time, self.measured = seconds, True
+            return
+        self.processing_time += self.ewma_alpha * (seconds - self.processing_time)
+
+    def _measure_streamed(self, future: Future):
+        # chamado na thread do socket assim que o prompt termina: agora - inicio na GPU e exato
+        if future.cancelled() or future.exception() is not None:
+            return
+        gpu_start = future.result()["gpu_start"]
+        if gpu_start is not None:
+            self.record_processing_time((datetime.datetime.now() - gpu_start).total_seconds())
+
+    def _measure_polled(self, entry: _PolledPrompt, history_entry: dict):
+        # o /history traz os timestamps (ms) de execution_start e execution_success do proprio ComfyUI
+        timestamps = {}
+        for message in history_entry.get("status", {}).get("messages", []):
+            if len(message) == 2 and isinstance(message[1], dict):
+                timestamps[message[0]] = message[1].get("timestamp")
+        started, finished = timestamps.get("execution_start"), timestamps.get("execution_success")
+        if started and finished:
+            seconds = (finished - started) / 1000
+        else:
+            # sem timestamps: terminou depois da ultima consulta vazia; usa esse limite inferior,
+            # errar para menos so antecipa a primeira consulta da proxima vez
+            seconds = entry.checked_at - entry.submitted_at
+        self.record_processing_time(max(seconds, 0.0))
+
+    def _pick_stream(self):
+        # sem cookie o socket pode estar em outro no; so serve quando ha um no so
+        connected = [s for s in self.streams if s.connected.is_set() and (s.cookie or self.single_target)]
+        if not connected:
+            return None
+        return min(connected, key=lambda s: s.pending)
+
+    def _history_fetcher(self, stream: ComfyUiEventStream):
+        return lambda prompt_id: comfyui_api_utils.get_history(prompt_id, self.server_address, stream.cookie)
+
+    def _track(self, prompt_id, aws_alb_cookie, future, first_check, interval, stream=None):
+        entry = _PolledPrompt(prompt_id, aws_alb_cookie, future, first_check, interval, stream)
+        future.add_done_callback(lambda _: self._untrack(prompt_id))
+        with self.lock:
+            if not future.done():
+                self.polled[prompt_id] = entry
+        self.wakeup.set()
+
+    def _untrack(self, prompt_id):
+        with self.lock:
+            self.polled.pop(prompt_id, None)
+
+    def _poll_loop(self):
+        while True:
+            self.wakeup.clear()
+            with self.lock:
+                entries = list(self.polled.values())
+            now = time.time()
+            due = [e for e in entries if e.next_check <= now]
+            if due:
+                self._check(due)
+                continue
+
+            timeout = min((e.next_check for e in entries), default=now + 60) - now
+            self.wakeup.wait(max(timeout, 0))
+
+    def _check(self, due: list):
+        by_cookie = {}
+        for entry in due:
+            by_cookie.setdefault(entry.aws_alb_cookie, []).append(entry)
+
+        for aws_alb_cookie, entries in by_cookie.items():
+            try:
+                if len(entries) == 1:
+                    history = comfyui_api_utils.get_history(entries[0].prompt_id, self.server_address, aws_alb_cookie)
+                else:
+                    history = comfyui_api_utils.get_recent_history(self.server_address, aws_alb_cookie,
+                                                                   max_items=max(64, 2 * len(entries)))
+            except Exception as e:
+                logger.debug(f"History poll failed: {e}")
+                history = {}
+
+            now = time.time()
+            for entry in entries:
+                if entry.prompt_id in history:
+                    if entry.stream is not None:
+                        entry.stream.resolve_from_history(entry.prompt_id, history[entry.prompt_id])
+                    elif not entry.future.done():
+                        self._measure_polled(entry, history[entry.prompt_id])
+                        entry.future.set_result({"outputs": history[entry.prompt_id].get("outputs", {}),
+                                                 "gpu_start": None, "profile": None})
+                    self._untrack(entry.prompt_id)
+                else:
+                    entry.checked_at = now
+                    entry.next_check = now + entry.interval
+                    entry.interval = min(entry.interval * 1.5, self.max_interval)
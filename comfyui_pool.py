@@ -0,0 +1,139 @@
+import threading
+import time
+import logging
+
+import requests
+
+from comfyui_transport import ComfyUiTransport
+
+logger = logging.getLogger(__name__)
+
+
+class ComfyUiBackend:
+    def __init__(self, address: str, initial_processing_time: float = 15.0):
+        self.address = address
+        self.healthy = True
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.queue_remote = 0          # running + pending reported by /queue
+        self.in_flight = 0             # generations this process routed here
+        self.processing_time = initial_processing_time  # media movel (s) por imagem
+        self.vram_free = None
+        self.last_probe = 0.0
+
+    def expected_wait(self) -> float:
+        # a fila remota ja inclui os nossos prompts, mas so e atualizada a cada probe
+        queue_length = max(self.queue_remote, self.in_flight)
+        return (queue_length + 1) * self.processing_time
+
+    def to_dict(self) -> dict:
+        return {
+            "address": self.address,
+            "healthy": self.healthy,
+            "failures": self.failures,
+            "queue_remote": self.queue_remote,
+            "in_flight": self.in_flight,
+            "processing_time": round(self.processing_time, 3),
+            "vram_free": self.vram_free,
+        }
+
+
+class NoBackendAvailable(Exception):
+    pass
+
+
+class ComfyUiBackendPool:
+    """
+    Keeps track of several ComfyUI servers and picks the one where a new
+    prompt is expected to finish first.
+
+    A background thread polls /queue and /system_stats on every backend.
+    Backends that fail `max_failures` times in a row are ejected for
+    `eject_seconds` and readmitted after a successful probe.
+
+    Parameters:
+    - addresses (list): host:port of each ComfyUI server.
+    - probe_interval (float): Seconds between probes of each backend.
+    - ewma_alpha (float): Weight of the newest sample in the processing time average.
+    """
+
+    def __init__(self, addresses, probe_interval: float = 1.0, probe_timeout: float = 2.0,
+                 max_failures: int = 3, eject_seconds: float = 30.0, ewma_alpha: float = 0.2):
+        if isinstance(addresses, str):
+            addresses = [addresses]
+        self.backends = [ComfyUiBackend(address) for address in addresses]
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self.max_failures = max_failures
+        self.eject_seconds = eject_seconds
+        self.ewma_alpha = ewma_alpha
+        self.transport = ComfyUiTransport()
+        self.lock = threading.Lock()
+        self._probe_thread = None
+
+    def start(self):
+        if self._probe_thread is None and len(self.backends) > 1:
+            self._probe_thread = threading.Thread(target=self._probe_loop, name="comfyui-probe", daemon=True)
+            self._probe_thread.start()
+
+    def acquire(self) -> ComfyUiBackend:
+        self.start()
+        now = time.time()
+        with self.lock:
+            candidates = [b for b in self.backends if b.healthy or b.ejected_until <= now]
+            if not candidates:
+                raise NoBackendAvailable("All ComfyUI backends are ejected")
+            backend = min(candidates, key=lambda b: b.expected_wait())
+            backend.in_flight += 1
+            return backend
+
+    def release(self, backend: ComfyUiBackend, processing_time: float = None, success: bool = True):
+        with self.lock:
+            backend.in_flight -= 1
+            if success:
+                backend.failures = 0
+                if processing_time is not None:
+                    backend.processing_time += self.ewma_alpha * (processing_time - backend.processing_time)
+            else:
+                self._mark_failure(backend)
+
+    def status(self) -> list:
+        with self.lock:
+            return [backend.to_dict() for backend in self.backends]
+
+    def _mark_failure(self, backend: ComfyUiBackend):
+        backend.failures += 1
+        if not backend.healthy:
+            # continua fora enquanto os probes falharem
+            backend.ejected_until = time.time() + self.eject_seconds
+        # com um unico backend nao ha para onde rotear, entao nunca ejeta
+        elif len(self.backends) > 1 and backend.failures >= self.max_failures:
+            backend.healthy = False
+            backend.ejected_until = time.time() + self.eject_seconds
+            logger.warning(f"Backend {backend.address} ejected after {backend.failures} failures.")
+
+    def _probe_loop(self):
+        while True:
+            for backend in self.backends:
+                self.probe(backend)
+            time.sleep(self.probe_interval)
+
+    def probe(self, backend: ComfyUiBackend):
+        try:
+            queue = self.transport.get(backend.address, "/queue", timeout=self.probe_timeout).json()
+            stats = self.transport.get(backend.address, "/system_stats", timeout=self.probe_timeout).json()
+        except (requests.RequestException, ValueError) as e:
+            logger.debug(f"Probe failed for {backend.address}: {e}")
+            with self.lock:
+                self._mark_failure(backend)
+            return
+
+        devices = stats.get("devices") or [{}]
+        with self.lock:
+            backend.queue_remote = len(queue.get("queue_running", [])) + len(queue.get("queue_pending", []))
+            backend.vram_free = devices[0].get("vram_free")
+            backend.last_probe = time.time()
+            backend.failures = 0
+            if not backend.healthy:
+                backend.healthy = True
+                logger.info(f"Backend {backend.address} readmitted.")
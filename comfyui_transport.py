@@ -0,0 +1,79 @@
+import os
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import parameters as param
+from singleton import Singleton
+
+
+class ComfyUiTransport(metaclass=Singleton):
+    """
+    Keep-alive HTTP connections shared by every ComfyUI call of the process.
+
+    Each backend (host) gets its own pool of at most `pool_maxsize`
+    connections; callers wait for a free connection instead of opening more.
+    The session never stores cookies: the AWSALB cookie is passed per call,
+    so a prompt and the calls that follow it stay on the same node without
+    pinning every other request to it.
+
+    Parameters:
+    - pool_maxsize (int): Connections per backend.
+    - connect_timeout (float): Seconds to establish a connection.
+    - read_timeout (float): Seconds to wait for response data.
+    """
+
+    def __init__(self, pool_maxsize: int = param.COMFYUI_POOL_MAXSIZE,
+                 connect_timeout: float = param.COMFYUI_CONNECT_TIMEOUT,
+                 read_timeout: float = param.COMFYUI_READ_TIMEOUT):
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=pool_maxsize, pool_block=True)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    @staticmethod
+    def url(server_address: str, path: str) -> str:
+        if not server_address.startswith(("http://", "https://")):
+            server_address = f"http://{server_address}"
+        return f"{server_address}{path}"
+
+    def request(self, method: str, server_address: str, path: str, cookie: str = None, timeout=None,
+                **kwargs) -> requests.Response:
+        headers = kwargs.pop("headers", None) or {}
+        if cookie:
+            headers["Cookie"] = cookie
+        return self.session.request(method, self.url(server_address, path), headers=headers,
+                                    timeout=timeout or self.timeout, **kwargs)
+
+    def get(self, server_address: str, path: str, **kwargs) -> requests.Response:
+        return self.request("GET", server_address, path, **kwargs)
+
+    def post(self, server_address: str, path: str, **kwargs) -> requests.Response:
+        return self.request("POST", server_address, path, **kwargs)
+
+    def download(self, server_address: str, path: str, destination: str, cookie: str = None, params: dict = None,
+                 chunk_size: int = 64 * 1024) -> str:
+        """
+        Streams the response body straight into `destination`. The file is
+        written under a temporary name and renamed at the end, so a partial
+        download is never visible.
+        """
+        partial = f"{destination}.part"
+        try:
+            with self.get(server_address, path, cookie=cookie, params=params, stream=True) as response:
+                response.raise_for_status()
+                with open(partial, "wb") as f:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+            os.replace(partial, destination)
+        except BaseException:
+            # conexao caiu ou disco cheio no meio: nao deixa o .part para tras
+            try:
+                os.remove(partial)
+            except OSError:
+                pass
+            raise
+        return destination
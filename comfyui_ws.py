@@ -0,0 +1,250 @@
+import threading
+import datetime
+import uuid
+import json
+import re
+import time
+import logging
+from collections import OrderedDict
+from concurrent.futures import Future, InvalidStateError
+
+import websocket
+
+logger = logging.getLogger(__name__)
+
+
+class PromptExecutionError(Exception):
+    pass
+
+
+class _PromptState:
+    def __init__(self):
+        self.future = Future()
+        self.outputs = {}
+        self.gpu_start = None
+        # perfil por no: segundos entre o "executing" do no e o evento seguinte
+        self.node_times = {}
+        self.cached_nodes = []
+        self.progress_steps = {}
+        self.current_node = None
+        self.node_started = None
+
+    def node_event(self, node_id, now: float):
+        if self.current_node is not None:
+            elapsed = now - self.node_started
+            self.node_times[self.current_node] = self.node_times.get(self.current_node, 0.0) + elapsed
+        self.current_node = node_id
+        self.node_started = now
+
+    def profile(self) -> dict:
+        return {"node_times": self.node_times, "cached": self.cached_nodes, "progress_steps": self.progress_steps}
+
+
+class ComfyUiEventStream:
+    """
+    Single long-lived WebSocket to one ComfyUI server, shared by every
+    generation of this process.
+
+    All prompts must be queued with `client_id`, so ComfyUI sends their
+    progress messages to this socket. A dispatcher thread reads the socket
+    and resolves the Future returned by `register` when the prompt finishes.
+    The result is a dict with the `outputs` reported by `executed` messages,
+    `gpu_start`, the moment the prompt left the queue, and `profile`, the
+    wall time of each node measured between consecutive `executing`
+    messages (None when the prompt was resolved from /history).
+
+    Behind an AWS ALB, `sticky=True` keeps the AWSALB cookie set by the
+    handshake and sends it on reconnects, so the socket stays on the same
+    node. Prompts queued with `cookie` then run on the node this socket
+    listens to.
+
+    Parameters:
+    - server_address (str): host:port or http(s)://host of the ComfyUI server.
+    - history_fetcher (callable): prompt_id -> /history response, used to recover
+      prompts that finished while the socket was reconnecting.
+    - sticky (bool): Remember the load balancer cookie from the handshake.
+    - idle_timeout (float): Seconds without any frame before a ping is sent; the
+      socket is reconnected if the pong does not arrive within the same time.
+    """
+
+    MAX_UNCLAIMED = 256
+
+    def __init__(self, server_address: str, history_fetcher=None, reconnect_delay: float = 1.0,
+                 client_id: str = None, sticky: bool = False, idle_timeout: float = 30.0):
+        self.server_address = server_address
+        self.history_fetcher = history_fetcher
+        self.reconnect_delay = reconnect_delay
+        self.client_id = client_id or str(uuid.uuid4())
+        self.sticky = sticky
+        self.idle_timeout = idle_timeout
+        self.cookie = None
+        self.states = OrderedDict()
+        self.claimed = set()
+        self.lock = threading.Lock()
+        self.connected = threading.Event()
+        self.closed = False
+        self.ws = None
+        self.thread = threading.Thread(target=self._run, name=f"comfyui-ws-{server_address}", daemon=True)
+        self.thread.start()
+
+    def wait_connected(self, timeout: float = 10.0) -> bool:
+        return self.connected.wait(timeout)
+
+    def register(self, prompt_id: str) -> Future:
+        with self.lock:
+            state = self._state(prompt_id)
+            self.claimed.add(prompt_id)
+        return state.future
+
+    def discard(self, prompt_id: str):
+        with self.lock:
+            self.states.pop(prompt_id, None)
+            self.claimed.discard(prompt_id)
+
+    def resolve_from_history(self, prompt_id: str, history_entry: dict):
+        with self.lock:
+            state = self._state(prompt_id)
+        self._finish(prompt_id, state, outputs=history_entry.get("outputs", {}))
+
+    def close(self):
+        self.closed = True
+        if self.ws is not None:
+            self.ws.close()
+
+    @property
+    def pending(self) -> int:
+        with self.lock:
+            return sum(1 for pid in self.claimed if not self.states[pid].future.done())
+
+    def _url(self) -> str:
+        address = self.server_address
+        if address.startswith("https://"):
+            return f"wss://{address[len('https://'):]}/ws?clientId={self.client_id}"
+        if address.startswith("http://"):
+            address = address[len("http://"):]
+        return f"ws://{address}/ws?clientId={self.client_id}"
+
+    def _update_cookie(self):
+        # o ALB devolve o cookie AWSALB no handshake; ele fixa o socket no no atual
+        for name, value in (self.ws.getheaders() or {}).items():
+            if name.lower() == "set-cookie":
+                match = re.search(r"AWSALB=[^;,\s]+", value)
+                if match:
+                    self.cookie = match.group(0)
+
+    def _state(self, prompt_id: str) -> _PromptState:
+        state = self.states.get(prompt_id)
+        if state is None:
+            state = self.states[prompt_id] = _PromptState()
+            # mensagens de prompts que ninguem reclamou nao podem crescer sem limite
+            while len(self.states) > self.MAX_UNCLAIMED + len(self.claimed):
+                oldest = next(pid for pid in self.states if pid not in self.claimed)
+                del self.states[oldest]
+        return state
+
+    def _finish(self, prompt_id: str, state: _PromptState, outputs: dict = None, error: Exception = None):
+        with self.lock:
+            if prompt_id in self.claimed:
+                # quem registrou ja tem a Future; o estado nao e mais necessario
+                self.states.pop(prompt_id, None)
+                self.claimed.discard(prompt_id)
+        if state.future.done():
+            return
+        if outputs:
+            state.outputs.update(outputs)
+        try:
+            if error is not None:
+                state.future.set_exception(error)
+            else:
+                # perfil so de execucoes acompanhadas ate o fim pelo socket
+                complete = state.node_times and state.current_node is None
+                state.future.set_result({"outputs": state.outputs, "gpu_start": state.gpu_start,
+                                         "profile": state.profile() if complete else None})
+        except InvalidStateError:
+            pass  # o historico e o socket resolveram ao mesmo tempo
+
+    def _run(self):
+        while not self.closed:
+            try:
+                self.ws = websocket.WebSocket()
+                header = [f"Cookie: {self.cookie}"] if self.cookie else []
+                self.ws.connect(self._url(), header=header, timeout=self.idle_timeout)
+                if self.sticky:
+                    self._update_cookie()
+                self.connected.set()
+                logger.info(f"Event stream connected to {self.server_address}.")
+                self._recover_missed()
+                self._receive_loop()
+            except Exception as e:
+                if not self.closed:
+                    logger.warning(f"Event stream to {self.server_address} lost: {e}")
+            finally:
+                self.connected.clear()
+                if self.ws is not None:
+                    self.ws.close()
+            time.sleep(self.reconnect_delay)
+
+    def _receive_loop(self):
+        # uma conexao meio aberta nunca entrega nada: sem quadro em idle_timeout manda ping,
+        # e se nem o pong chegar no mesmo prazo derruba o socket para reconectar
+        ping_sent = False
+        while True:
+            try:
+                opcode, data = self.ws.recv_data(control_frame=True)
+            except websocket.WebSocketTimeoutException:
+                if ping_sent:
+                    raise ConnectionError(f"no pong in {self.idle_timeout}s")
+                self.ws.ping()
+                ping_sent = True
+                continue
+            ping_sent = False
+            if opcode == websocket.ABNF.OPCODE_CLOSE:
+                raise ConnectionError("closed by the server")
+            if opcode == websocket.ABNF.OPCODE_TEXT and data:
+                self._dispatch(json.loads(data))
+
+    def _dispatch(self, message: dict):
+        data = message.get("data") or {}
+        prompt_id = data.get("prompt_id")
+        if prompt_id is None:
+            return  # status, previews etc.
+
+        message_type = message.get("type")
+        with self.lock:
+            state = self._state(prompt_id)
+
+        now = time.perf_counter()
+        if message_type == "execution_start":
+            state.gpu_start = datetime.datetime.now()
+            state.node_event(None, now)
+        elif message_type == "execution_cached":
+            state.cached_nodes = list(data.get("nodes") or [])
+        elif message_type == "progress":
+            state.progress_steps[data.get("node")] = data.get("max")
+        elif message_type == "executed":
+            state.outputs[data["node"]] = data.get("output") or {}
+        elif message_type == "executing" and data.get("node") is None:
+            state.node_event(None, now)
+            self._finish(prompt_id, state)
+        elif message_type == "executing":
+            state.node_event(data["node"], now)
+        elif message_type == "execution_error":
+            self._finish(prompt_id, state, error=PromptExecutionError(
+                f"Node {data.get('node_id')} ({data.get('node_type')}): {data.get('exception_message')}"))
+        elif message_type == "execution_interrupted":
+            self._finish(prompt_id, state, error=PromptExecutionError("Execution interrupted"))
+
+    def _recover_missed(self):
+        # depois de reconectar, mensagens de fim podem ter sido perdidas
+        if self.history_fetcher is None:
+            return
+        with self.lock:
+            pending = [pid for pid in self.claimed if not self.states[pid].future.done()]
+        for prompt_id in pending:
+            try:
+                history = self.history_fetcher(prompt_id)
+            except Exception as e:
+                logger.debug(f"History check for {prompt_id} failed: {e}")
+                continue
+            if prompt_id in history:
+                self.resolve_from_history(prompt_id, history[prompt_id])
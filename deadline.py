@@ -0,0 +1,75 @@
+import threading
+import time
+
+
+class GenerationCancelled(Exception):
+    pass
+
+
+class DeadlineExceeded(GenerationCancelled):
+    pass
+
+
+class Deadline:
+    """
+    Time limit and cancellation signal carried by one generation, from the
+    HTTP request down to the wait for ComfyUI. The clients check it between
+    steps and wait on ComfyUI at most `remaining()` seconds; `cancel()` (the
+    requester went away) wakes them up through the registered callbacks, so
+    they can remove the prompt from ComfyUI and free the thread.
+
+    Parameters:
+    - seconds (float): Time limit from now; None means no limit, only cancellation.
+    """
+
+    def __init__(self, seconds: float = None):
+        self.expires_at = time.monotonic() + seconds if seconds is not None else None
+        self.reason = None
+        self.callbacks = []
+        self.lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.reason is not None
+
+    def remaining(self) -> float:
+        """Seconds left (never negative), or None without a time limit."""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.cancelled or (self.expires_at is not None and time.monotonic() >= self.expires_at)
+
+    def timeout(self, limit: float) -> float:
+        """`limit` capped by the time left; for waits that must not outlive the deadline."""
+        remaining = self.remaining()
+        return limit if remaining is None else min(limit, remaining)
+
+    def check(self):
+        if self.cancelled:
+            raise GenerationCancelled(self.reason)
+        if self.expired():
+            raise DeadlineExceeded("Generation deadline exceeded")
+
+    def cancel(self, reason: str = "Cancelled by the requester"):
+        with self.lock:
+            if self.reason is not None:
+                return
+            self.reason = reason
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def add_callback(self, callback):
+        """Runs `callback()` on cancellation (right away if already cancelled)."""
+        with self.lock:
+            if self.reason is None:
+                self.callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback):
+        with self.lock:
+            if callback in self.callbacks:
+                self.callbacks.remove(callback)
@@ -0,0 +1,91 @@
+import io
+import json
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_image(data: bytes, max_side: int, quality: int) -> bytes:
+    """
+    Applies the EXIF orientation, downscales so the longest side is at most
+    `max_side` and re-encodes as JPEG. Runs in a worker process.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        if image.format == "JPEG" and max(image.size) <= max_side and image.getexif().get(0x0112, 1) == 1:
+            return data  # ja esta no formato certo; reencodar so perderia qualidade
+
+        # JPEG: decodifica direto numa escala reduzida, bem mais barato que decodificar 12 MP
+        image.draft("RGB", (max_side, max_side))
+        image = ImageOps.exif_transpose(image)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=quality)
+    return output.getvalue()
+
+
+def working_resolution(workflow_path: str, node_id_image_load: str, default: int = 1600) -> int:
+    """
+    Returns the size the workflow resizes the loaded photo to, read from the
+    ImageResize+ node fed by the LoadImage node. Falls back to `default`.
+    """
+    with open(workflow_path, "r", encoding="utf-8") as f:
+        workflow = json.load(f)
+
+    for node in workflow.values():
+        inputs = node.get("inputs", {})
+        if node.get("class_type") == "ImageResize+" and inputs.get("image", [None])[0] == node_id_image_load:
+            return max(inputs["width"], inputs["height"])
+    return default
+
+
+class ImagePreprocessor:
+    """
+    Shrinks uploaded photos on a pool of worker processes before they are
+    sent to ComfyUI, so phones' 4-12 MP photos don't cross the network only
+    to be downscaled on the GPU node.
+
+    Parameters:
+    - max_side (int): Longest side of the normalized image, in pixels.
+    - quality (int): JPEG quality of the normalized image.
+    - max_workers (int): Worker processes, started on the first `process` call.
+    """
+
+    def __init__(self, max_side: int, quality: int = 90, max_workers: int = 2):
+        self.max_side = max_side
+        self.quality = quality
+        self.max_workers = max_workers
+        self.executor = None
+        self.executor_lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # criado so no primeiro uso: no Windows (spawn) cada worker reimporta o __main__,
+        # entao nada de processos durante o import do app
+        with self.executor_lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self.executor
+
+    def process(self, image):
+        """Returns a file object with the normalized JPEG, or `image` itself if it can't be decoded."""
+        if isinstance(image, str):
+            with open(image, "rb") as f:
+                data = f.read()
+        else:
+            image.seek(0)
+            data = image.read()
+
+        try:
+            normalized = self._get_executor().submit(normalize_image, data, self.max_side, self.quality).result()
+        except Exception as e:
+            logger.warning(f"Preprocessing failed, sending original image: {e}")
+            return image
+
+        logger.debug(f"Preprocessed input: {len(data)} -> {len(normalized)} bytes")
+        return io.BytesIO(normalized)
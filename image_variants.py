@@ -0,0 +1,89 @@
+import os
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# formato -> (formato do PIL, extensao, opcoes de encode)
+VARIANT_FORMATS = {
+    "png": ("PNG", "png", {"optimize": True}),
+    "jpg": ("JPEG", "jpg", {"quality": 88, "progressive": True}),
+    "webp": ("WEBP", "webp", {"quality": 85, "method": 4}),
+}
+
+
+def variant_path(source_path: str, variant: str) -> str:
+    base, _ = os.path.splitext(source_path)
+    return f"{base}_{variant}.{VARIANT_FORMATS[variant][1]}"
+
+
+def encode_variant(source_path: str, variant: str) -> str:
+    """
+    Re-encodes the generated image as `variant` next to the original.
+    Runs in a worker process; the file appears only once fully written.
+    """
+    pil_format, _, options = VARIANT_FORMATS[variant]
+    destination = variant_path(source_path, variant)
+    partial = f"{destination}.part"
+    with Image.open(source_path) as image:
+        if pil_format == "JPEG" and image.mode != "RGB":
+            image = image.convert("RGB")
+        image.save(partial, format=pil_format, **options)
+    os.replace(partial, destination)
+    return destination
+
+
+class VariantEncoder:
+    """
+    Produces derivative encodes of the generated images (optimized PNG,
+    JPEG or WebP for sharing) on a pool of worker processes, after the
+    original bytes from ComfyUI are already saved and served.
+
+    Parameters:
+    - variants (list): Keys of VARIANT_FORMATS to produce for every image.
+    - max_workers (int): Worker processes, started with the first submitted image.
+    """
+
+    def __init__(self, variants: list, max_workers: int = 1):
+        unknown = set(variants) - set(VARIANT_FORMATS)
+        if unknown:
+            raise ValueError(f"Unknown image variants: {sorted(unknown)}")
+        self.variants = list(variants)
+        self.max_workers = max_workers
+        self.executor = None
+        self.executor_lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # criado so no primeiro uso, como em ImagePreprocessor: nada de processos no import do app
+        with self.executor_lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self.executor
+
+    def submit(self, source_path: str, on_ready=None) -> dict:
+        """
+        Queues every variant of `source_path` and returns {variant: Future}.
+        `on_ready(variant, path)` is called as each one is written.
+        """
+        futures = {}
+        if not self.variants:
+            return futures
+        executor = self._get_executor()
+        for variant in self.variants:
+            future = executor.submit(encode_variant, source_path, variant)
+            future.add_done_callback(lambda f, v=variant: self._done(source_path, v, f, on_ready))
+            futures[variant] = future
+        return futures
+
+    @staticmethod
+    def _done(source_path, variant, future, on_ready):
+        try:
+            path = future.result()
+        except Exception as e:
+            logger.warning(f"Could not encode {variant} variant of {source_path}: {e}")
+            return
+        if on_ready is not None:
+            on_ready(variant, path)
@@ -0,0 +1,157 @@
+import threading
+import time
+import uuid
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from deadline import Deadline
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_ERROR = "error"
+JOB_CANCELLED = "cancelled"
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, job_id: str, metadata: dict = None, deadline: Deadline = None):
+        self.id = job_id
+        self.status = JOB_QUEUED
+        self.metadata = metadata or {}
+        self.deadline = deadline or Deadline()
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.last_seen = self.created_at  # ultima vez que o cliente consultou o job
+        self.done_event = threading.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JOB_DONE, JOB_ERROR, JOB_CANCELLED)
+
+    def to_dict(self) -> dict:
+        data = {
+            "job_id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.status == JOB_DONE:
+            data["result"] = self.result
+        if self.status in (JOB_ERROR, JOB_CANCELLED):
+            data["error"] = self.error
+        return data
+
+
+class JobManager:
+    """
+    Runs long generations on a bounded pool of background threads so the
+    HTTP worker can answer with a job ID right away.
+
+    Parameters:
+    - max_workers (int): Generations running at the same time.
+    - max_pending (int): Jobs accepted but not finished before new submissions are refused.
+    - ttl_seconds (int): How long finished jobs are kept for polling.
+
+    Every job carries a Deadline; `fn` gets it through its own arguments and
+    is expected to stop when it is cancelled (`cancel`, or `cancel_abandoned`
+    once nobody polls the job any more).
+    """
+
+    def __init__(self, max_workers: int = 8, max_pending: int = 500, ttl_seconds: int = 900):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.max_pending = max_pending
+        self.ttl_seconds = ttl_seconds
+        self.jobs = {}
+        self.finished = deque()  # jobs terminados, em ordem de finished_at
+        self.pending = 0
+        self.lock = threading.Lock()
+
+    def submit(self, fn, *args, metadata: dict = None, deadline: Deadline = None, **kwargs) -> Job:
+        with self.lock:
+            self._purge_expired()
+            if self.pending >= self.max_pending:
+                raise JobQueueFull(f"{self.pending} jobs already pending")
+            job = Job(str(uuid.uuid4()), metadata, deadline)
+            self.jobs[job.id] = job
+            self.pending += 1
+
+        self.executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id: str) -> Job:
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is not None:
+            job.last_seen = time.time()
+        return job
+
+    def wait(self, job_id: str, timeout: float) -> Job:
+        job = self.get(job_id)
+        if job is not None and timeout > 0:
+            job.done_event.wait(timeout)
+            job.last_seen = time.time()
+        return job
+
+    def cancel(self, job_id: str, reason: str = "Cancelled by the requester") -> Job:
+        job = self.get(job_id)
+        if job is not None and not job.finished:
+            job.deadline.cancel(reason)
+        return job
+
+    def cancel_abandoned(self, idle_seconds: float) -> int:
+        """Cancels unfinished jobs nobody polled for `idle_seconds`; returns how many."""
+        limit = time.time() - idle_seconds
+        with self.lock:
+            abandoned = [job for job in self.jobs.values() if not job.finished and job.last_seen <= limit]
+        for job in abandoned:
+            logger.info(f"Job {job.id} abandoned, cancelling.")
+            job.deadline.cancel("Requester went away")
+        return len(abandoned)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"pending": self.pending, "tracked": len(self.jobs)}
+
+    def _run(self, job: Job, fn, args, kwargs):
+        job.status = JOB_RUNNING
+        job.started_at = time.time()
+        # BaseException (SystemExit, KeyboardInterrupt) nao passa pelo except: o job termina como erro
+        status = JOB_ERROR
+        try:
+            job.result = fn(*args, **kwargs)
+            status = JOB_DONE
+        except Exception as e:
+            job.error = str(e)
+            if job.deadline.cancelled:
+                logger.info(f"Job {job.id} cancelled: {job.deadline.reason}")
+                status = JOB_CANCELLED
+            else:
+                logger.exception(f"Job {job.id} failed.")
+        finally:
+            if status == JOB_ERROR:
+                job.error = job.error or "Generation interrupted"
+            with self.lock:
+                # finished_at antes do status, os dois dentro do lock: quem ve o job terminado ve o horario,
+                # e a fila de terminados fica ordenada
+                job.finished_at = time.time()
+                job.status = status
+                self.finished.append(job)
+                self.pending -= 1
+            job.done_event.set()
+
+    def _purge_expired(self):
+        # so olha o inicio da fila: custo proporcional aos jobs vencidos, nao a todos
+        limit = time.time() - self.ttl_seconds
+        while self.finished and self.finished[0].finished_at <= limit:
+            del self.jobs[self.finished.popleft().id]
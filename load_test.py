@@ -0,0 +1,145 @@
+"""
+Load generator for app_kingsday's /api/upload.
+
+Sends `--requests` uploads with at most `--concurrency` in flight and
+reports, per stage, p50/p95/p99 latency, throughput and error rate.
+
+Stages:
+- sync mode: "upload" (the whole POST, generation included) and "download".
+- job mode: "submit" (POST until the 202), "generate" (202 until the job
+  is done, long-polling /api/jobs/<id>) and "download".
+
+Run it against a local mock_comfyui.py to size workers without a GPU:
+    python mock_comfyui.py --latency 8 --slots 2
+    python app_kingsday.py
+    python load_test.py --url http://localhost:5003 --image photo.jpg --concurrency 16 --requests 200 --mode job
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import aiohttp
+
+
+class StageStats:
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+
+    def percentile(self, p: float) -> float:
+        if not self.latencies:
+            return float("nan")
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+class LoadTest:
+    def __init__(self, url: str, image: bytes, concurrency: int, total: int, mode: str, timeout: float):
+        self.url = url.rstrip("/")
+        self.image = image
+        self.concurrency = concurrency
+        self.total = total
+        self.mode = mode
+        self.timeout = timeout
+        self.stages = {}
+
+    def record(self, stage: str, started: float, ok: bool = True):
+        stats = self.stages.setdefault(stage, StageStats())
+        if ok:
+            stats.latencies.append(time.perf_counter() - started)
+        else:
+            stats.errors += 1
+
+    async def run(self) -> float:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        connector = aiohttp.TCPConnector(limit=self.concurrency * 2)
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+            started = time.perf_counter()
+            await asyncio.gather(*(self.one(session, semaphore) for _ in range(self.total)))
+            return time.perf_counter() - started
+
+    async def one(self, session: aiohttp.ClientSession, semaphore: asyncio.Semaphore):
+        async with semaphore:
+            form = aiohttp.FormData()
+            form.add_field("image", self.image, filename="load_test.jpg", content_type="image/jpeg")
+            form.add_field("choice", random.choice(["king", "queen"]))
+            if self.mode == "job":
+                form.add_field("mode", "job")
+
+            stage = "submit" if self.mode == "job" else "upload"
+            started = time.perf_counter()
+            try:
+                async with session.post(f"{self.url}/api/upload", data=form) as response:
+                    body = await response.json(content_type=None)
+                    ok = response.status in (200, 202)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+                ok, body = False, {}
+            self.record(stage, started, ok)
+            if not ok:
+                return
+
+            if self.mode == "job":
+                image_url = await self.wait_job(session, body["status_url"])
+            else:
+                image_url = body.get("image_url")
+            if image_url:
+                await self.download(session, image_url)
+
+    async def wait_job(self, session: aiohttp.ClientSession, status_url: str):
+        started = time.perf_counter()
+        try:
+            while True:
+                async with session.get(f"{self.url}{status_url}", params={"wait": "25"}) as response:
+                    job = await response.json(content_type=None)
+                if job["status"] == "done" and response.status == 200:
+                    self.record("generate", started)
+                    return job["result"]["image_url"]
+                # "error", "cancelled" ou qualquer outro estado final: ?wait= volta na hora, nao insistir
+                if response.status != 200 or job["status"] not in ("queued", "running"):
+                    self.record("generate", started, ok=False)
+                    return None
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError):
+            self.record("generate", started, ok=False)
+            return None
+
+    async def download(self, session: aiohttp.ClientSession, image_url: str):
+        started = time.perf_counter()
+        try:
+            async with session.get(f"{self.url}{image_url}") as response:
+                await response.read()
+                self.record("download", started, response.status == 200)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.record("download", started, ok=False)
+
+    def report(self, elapsed: float):
+        print(f"{self.total} requests, concurrency {self.concurrency}, mode {self.mode}, {elapsed:.1f}s")
+        print(f"{'stage':<10}{'ok':>6}{'err':>6}{'err%':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'req/s':>9}")
+        for name, stats in self.stages.items():
+            count = len(stats.latencies) + stats.errors
+            print(f"{name:<10}{len(stats.latencies):>6}{stats.errors:>6}{100 * stats.errors / count:>6.1f}%"
+                  f"{stats.percentile(50):>8.2f}s{stats.percentile(95):>8.2f}s{stats.percentile(99):>8.2f}s"
+                  f"{len(stats.latencies) / elapsed:>9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test for /api/upload.")
+    parser.add_argument("--url", default="http://localhost:5003")
+    parser.add_argument("--image", required=True, help="photo sent in every request")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--mode", choices=["sync", "job"], default="sync")
+    parser.add_argument("--timeout", type=float, default=600, help="per-request timeout (s)")
+    args = parser.parse_args()
+
+    with open(args.image, "rb") as f:
+        image = f.read()
+
+    test = LoadTest(args.url, image, args.concurrency, args.requests, args.mode, args.timeout)
+    elapsed = asyncio.run(test.run())
+    test.report(elapsed)
+
+
+if __name__ == "__main__":
+    main()
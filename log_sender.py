@@ -1,22 +1,95 @@
+import atexit
 import csv
+import io
+import os
 import time
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 import parameters
 from datetime import datetime
 
 csv_filename = 'logs/datalogs.csv'
 backup_filename = 'logs/datalogs_backup.csv'
 
+FIELDNAMES = ['status', 'project', 'additional', 'timePlayed']
+
+# protege o journal: o DatalogWriter faz append, o shipper so o trunca quando tudo foi enviado
+journal_lock = threading.Lock()
+
 
 def init_csv(filename):
     try:
         with open(filename, mode='x', newline='') as file:
             writer = csv.writer(file)
-            writer.writerow(['status', 'project', 'additional', 'timePlayed'])
+            writer.writerow(FIELDNAMES)
     except FileExistsError:
         pass
 
 
+class DatalogWriter:
+    """
+    Single writer for the datalog journal. save_csv only puts the row on a
+    queue; a background thread appends everything queued in the last
+    `flush_interval` seconds with one write under `journal_lock`, so
+    requests never wait for the disk and concurrent writers can't lose or
+    interleave rows. Rows are always written whole, which is what lets the
+    shipper read the journal while it grows.
+
+    Parameters:
+    - filename (str): The CSV journal.
+    - flush_interval (float): Seconds between group commits.
+    """
+
+    def __init__(self, filename: str, flush_interval: float = 0.2):
+        self.filename = filename
+        self.flush_interval = flush_interval
+        self.rows = []
+        self.lock = threading.Lock()
+        self.pending = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="datalog-writer", daemon=True)
+        self.thread.start()
+        atexit.register(self.flush)
+
+    def write(self, row: list):
+        with self.lock:
+            self.rows.append(row)
+        self.pending.set()
+
+    def flush(self):
+        with journal_lock:
+            with self.lock:
+                rows, self.rows = self.rows, []
+                self.pending.clear()
+            if not rows:
+                return
+
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(rows)
+            try:
+                with open(self.filename, mode='a', newline='') as file:
+                    file.write(buffer.getvalue())
+            except OSError:
+                with self.lock:
+                    self.rows[:0] = rows  # tenta de novo no proximo ciclo, na mesma ordem
+                raise
+        print(f"{datetime.now()} - {len(rows)} logs salvos com sucesso!")
+
+    def _run(self):
+        while True:
+            # espera o primeiro evento e junta os que chegarem no intervalo num unico append
+            self.pending.wait()
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError as e:
+                print(f'{datetime.now()} - Falha ao gravar logs: {e}')
+
+
+writer = DatalogWriter(csv_filename, flush_interval=parameters.LOG_FLUSH_INTERVAL_MS / 1000)
+
+
 def save_csv(status):
     time_played = datetime.now()
     formatted_time_played = time_played.strftime("%Y-%m-%dT%H:%M:%SZ")
@@ -25,10 +98,7 @@ def save_csv(status):
     additional = ''
     time_played = formatted_time_played
 
-    with open(csv_filename, mode='a', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow([status, project, additional, time_played])
-    print(f"{time_played} - {status} - salvo com sucesso!")
+    writer.write([status, project, additional, time_played])
 
 
 def save_csv_additional(status, additional_send):
@@ -39,13 +109,10 @@ def save_csv_additional(status, additional_send):
     additional = additional_send
     time_played = formatted_time_played
 
-    with open(csv_filename, mode='a', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow([status, project, additional, time_played])
-    print(f"{time_played} - {status} - salvo com sucesso!")
+    writer.write([status, project, additional, time_played])
 
 
-def send_log(status, project, additional, time_played):
+def send_log(status, project, additional, time_played, session=None):
     url = parameters.LOG_API + "/datalog/upload"
     timestamp = datetime.now()
     data = {
@@ -56,42 +123,181 @@ def send_log(status, project, additional, time_played):
     }
 
     try:
-        response = requests.post(url, data=data)
+        response = (session or requests).post(url, data=data, timeout=parameters.LOG_SEND_TIMEOUT)
         if response.status_code == 200:
-            print(f'{timestamp} - Requisição bem-sucedida')
             return True
         else:
             print(f'{timestamp} -  Falha na requisição:', response.status_code)
             return False
-    except requests.exceptions.ConnectionError:
-        print(f'{timestamp} - Falha na conexão: Não foi possível conectar ao servidor')
+    except requests.exceptions.RequestException as e:
+        print(f'{timestamp} - Falha na conexão: Não foi possível conectar ao servidor ({e})')
         return False
 
 
+class DatalogShipper:
+    """
+    Ships the datalog journal to LOG_API.
+
+    The journal is append-only. Shipped rows are never rewritten; the
+    shipper keeps the byte offset of the first row not yet delivered in a
+    checkpoint file and each cycle reads only what was appended after it,
+    so a cycle costs as much as the new events. Delivery is at-least-once:
+    the offset only moves past a contiguous run of delivered rows.
+
+    Rows are sent over a pooled session, at most `concurrency` at a time,
+    or in batches of `batch_size` when LOG_BATCH_API is configured and the
+    endpoint accepts it. While the remote is down the wait between cycles
+    doubles, up to `max_backoff` seconds.
+
+    Parameters:
+    - journal (str): The CSV journal written by save_csv.
+    - backup (str): CSV that receives a copy of every shipped row.
+    - interval (float): Seconds between cycles while the remote is healthy.
+    - concurrency (int): Uploads in flight at the same time.
+    - batch_size (int): Rows per batch upload (and per cycle window).
+    - max_backoff (float): Longest wait between cycles while failing.
+    """
+
+    def __init__(self, journal: str, backup: str, interval: float = 120, concurrency: int = 4,
+                 batch_size: int = 100, max_backoff: float = 600):
+        self.journal = journal
+        self.backup = backup
+        self.checkpoint = f"{os.path.splitext(journal)[0]}.offset"
+        self.interval = interval
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.max_backoff = max_backoff
+        self.batch_url = parameters.LOG_API + parameters.LOG_BATCH_API if parameters.LOG_BATCH_API else None
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="datalog")
+
+    def run(self):
+        delay = self.interval
+        while True:
+            try:
+                delivered_all = self.ship_pending()
+            except OSError as e:
+                print(f'{datetime.now()} - Falha ao ler o journal de logs: {e}')
+                delivered_all = False
+
+            # remoto fora do ar: espera cada vez mais entre as tentativas
+            delay = self.interval if delivered_all else min(delay * 2, self.max_backoff)
+            time.sleep(delay)
+
+    def ship_pending(self) -> bool:
+        """Ships everything appended since the checkpoint; returns False if a row could not be delivered."""
+        start, rows, ends = self.read_new_rows(self.read_checkpoint())
+        shipped = 0
+        for first in range(0, len(rows), self.batch_size):
+            window = rows[first:first + self.batch_size]
+            delivered = self.send_window(window)
+            if delivered:
+                end = ends[first + delivered - 1]
+                self.commit(start, end)
+                start = end
+                shipped += delivered
+            if delivered < len(window):
+                print(f"Sending logs: {shipped} enviados, {len(rows) - shipped} pendentes")
+                return False
+
+        if rows:
+            print(f"Sending logs: {shipped} enviados")
+        self.compact()
+        return True
+
+    def send_window(self, rows: list) -> int:
+        """Sends the rows and returns how many of the first ones were delivered, in order."""
+        if self.batch_url:
+            delivered = self.send_batch(rows)
+            if delivered is not None:
+                return delivered
+
+        results = self.executor.map(lambda row: send_log(*row, session=self.session), rows)
+        delivered = 0
+        for success in results:
+            if not success:
+                break
+            delivered += 1
+        return delivered
+
+    def send_batch(self, rows: list):
+        """Returns the rows delivered by the batch endpoint, or None if it is not supported."""
+        payload = [dict(zip(FIELDNAMES, row)) for row in rows]
+        try:
+            response = self.session.post(self.batch_url, json=payload, timeout=parameters.LOG_SEND_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            print(f'{datetime.now()} - Falha na conexão: Não foi possível conectar ao servidor ({e})')
+            return 0
+        if response.status_code in (404, 405, 501):
+            print(f'{datetime.now()} - Envio em lote não suportado ({response.status_code}), enviando por linha')
+            self.batch_url = None
+            return None
+        return len(rows) if response.status_code == 200 else 0
+
+    def read_checkpoint(self) -> int:
+        try:
+            with open(self.checkpoint, "r") as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def write_checkpoint(self, offset: int):
+        partial = f"{self.checkpoint}.part"
+        with open(partial, "w") as f:
+            f.write(str(offset))
+        os.replace(partial, self.checkpoint)
+
+    def read_new_rows(self, offset: int):
+        """
+        Returns (start, rows, ends) for the complete rows after `offset`:
+        where the first row starts (after the header) and the byte offset
+        where each row ends.
+        """
+        with open(self.journal, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+
+        start = offset
+        rows, ends = [], []
+        position = offset
+        for line in data.splitlines(keepends=True):
+            if not line.endswith(b"\n"):
+                break  # linha ainda sendo escrita; fica para o proximo ciclo
+            position += len(line)
+            row = next(csv.reader([line.decode("utf-8")]), None)
+            if not row or row == FIELDNAMES:
+                if not rows:
+                    start = position  # cabecalho ou linha vazia antes das linhas novas
+                continue
+            rows.append(row)
+            ends.append(position)
+        return start, rows, ends
+
+    def commit(self, start: int, end: int):
+        # copia os bytes enviados para o backup antes de avancar o checkpoint
+        with open(self.journal, "rb") as f:
+            f.seek(start)
+            shipped = f.read(end - start)
+        with open(self.backup, "ab") as f:
+            f.write(shipped)
+        self.write_checkpoint(end)
+
+    def compact(self):
+        # tudo enviado: zera o journal (com o cabecalho) para ele nao crescer indefinidamente
+        with journal_lock:
+            offset = self.read_checkpoint()
+            if offset == 0 or os.path.getsize(self.journal) != offset:
+                return
+            with open(self.journal, mode='w', newline='') as file:
+                csv.writer(file).writerow(FIELDNAMES)
+            self.write_checkpoint(0)
+
+
 def process_csv_and_send_logs(csv_filename, backup_filename):
-    while True:
-        rows_to_keep = []
-        rows_to_backup = []
-
-        with open(csv_filename, mode='r') as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                success = send_log(row['status'], row['project'], row['additional'], row['timePlayed'])
-                if success:
-                    rows_to_backup.append(row)
-                else:
-                    rows_to_keep.append(row)
-
-        with open(csv_filename, mode='w', newline='') as file:
-            fieldnames = ['status', 'project', 'additional', 'timePlayed']
-            writer = csv.DictWriter(file, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(rows_to_keep)
-
-        with open(backup_filename, mode='a', newline='') as file:
-            writer = csv.DictWriter(file, fieldnames=fieldnames)
-            writer.writerows(rows_to_backup)
-
-        print("Sending logs")
-
-        time.sleep(120)
+    DatalogShipper(csv_filename, backup_filename,
+                   interval=parameters.LOG_SEND_INTERVAL,
+                   concurrency=parameters.LOG_SEND_CONCURRENCY,
+                   batch_size=parameters.LOG_BATCH_SIZE).run()
@@ -0,0 +1,171 @@
+import bisect
+import threading
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 12, 16, 24, 32, 48, 64, 96, 128)
+
+
+def _label_key(label_names: tuple, labels: dict) -> tuple:
+    return tuple(str(labels.get(name, "")) for name in label_names)
+
+
+def _format_labels(label_names: tuple, key: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in zip(label_names, key)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(self.label_names, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self, kind: str = "counter") -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {kind}"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        key = _label_key(self.label_names, labels)
+        with self.lock:
+            self.values[key] = value
+
+    def render(self, kind: str = "gauge") -> list:
+        return super().render(kind)
+
+
+class _HistogramSeries:
+    __slots__ = ("buckets", "count", "sum")
+
+    def __init__(self, size: int):
+        self.buckets = [0] * size
+        self.count = 0
+        self.sum = 0.0
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram: an observation is a bisect and three additions
+    under a lock, cheap enough for every generation. Quantiles are
+    estimated from the buckets.
+    """
+
+    def __init__(self, name: str, documentation: str, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.bounds = tuple(sorted(buckets))
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(self.label_names, labels)
+        index = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = _HistogramSeries(len(self.bounds) + 1)
+            series.buckets[index] += 1
+            series.count += 1
+            series.sum += value
+
+    def summary(self, group_by: str) -> dict:
+        """Merges the series by one label; returns {value: {count, mean, p50, p95, p99}}."""
+        position = self.label_names.index(group_by)
+        merged = {}
+        with self.lock:
+            for key, series in self.series.items():
+                total = merged.setdefault(key[position], _HistogramSeries(len(self.bounds) + 1))
+                total.buckets = [a + b for a, b in zip(total.buckets, series.buckets)]
+                total.count += series.count
+                total.sum += series.sum
+        return {value: {"count": s.count, "mean": s.sum / s.count if s.count else 0.0,
+                        "p50": self._quantile(s, 0.5), "p95": self._quantile(s, 0.95), "p99": self._quantile(s, 0.99)}
+                for value, s in sorted(merged.items())}
+
+    def _quantile(self, series: _HistogramSeries, q: float) -> float:
+        if not series.count:
+            return 0.0
+        rank = q * series.count
+        cumulative = 0
+        for index, count in enumerate(series.buckets):
+            if count and cumulative + count >= rank:
+                lower = self.bounds[index - 1] if index > 0 else 0.0
+                upper = self.bounds[index] if index < len(self.bounds) else lower
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.bounds[-1]
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, series in sorted(self.series.items()):
+                cumulative = 0
+                for bound, count in zip(self.bounds + (float("inf"),), series.buckets):
+                    cumulative += count
+                    le = 'le="+Inf"' if bound == float("inf") else f'le="{bound:g}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {series.sum}")
+                lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {series.count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    "comfyui_stage_seconds", "Duration of each generation stage.", ("stage", "backend", "workflow")))
+GENERATIONS = registry.register(Counter(
+    "comfyui_generations_total", "Finished generations by result.", ("result", "backend", "workflow")))
+IN_FLIGHT = registry.register(Gauge(
+    "comfyui_generations_in_flight", "Generations currently running.", ("backend",)))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def observe_generation(timing: dict, start_time, backend: str, workflow: str):
+    """
+    Records the stage durations of one generation from its `timing` marks
+    (datetimes): upload, start_execution, gpu_start (optional),
+    execution_done and save.
+    """
+    gpu_start = timing.get("gpu_start", timing["start_execution"])
+    stages = {
+        "upload": timing["upload"] - start_time,
+        "queue_wait": gpu_start - timing["start_execution"],
+        "processing": timing["execution_done"] - gpu_start,
+        "save": timing["save"] - timing["execution_done"],
+        "total": timing["save"] - start_time,
+    }
+    for stage, duration in stages.items():
+        STAGE_SECONDS.observe(max(duration.total_seconds(), 0.0), stage=stage, backend=backend, workflow=workflow)
@@ -0,0 +1,249 @@
+"""
+Stand-in ComfyUI server for benchmarks, without a GPU.
+
+Implements the endpoints the app uses: /upload/image, /prompt, /history,
+/view, /queue, /interrupt, /system_stats and the /ws event stream, with
+configurable latencies, GPU slots and failure rate. Prompts wait in a
+FIFO queue and "run" for --latency seconds (plus jitter), emitting the
+same WebSocket messages as ComfyUI.
+
+Usage:
+    python mock_comfyui.py --port 7821 --latency 8 --jitter 2 --slots 1
+"""
+import argparse
+import asyncio
+import random
+import struct
+import time
+import uuid
+import zlib
+import logging
+
+from aiohttp import web, WSMsgType
+
+logger = logging.getLogger(__name__)
+
+
+def make_png(width: int, height: int) -> bytes:
+    """Noise PNG so downloads and encodes cost about as much as a real output."""
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    rows = b"".join(b"\x00" + random.randbytes(width * 3) for _ in range(height))
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(rows, 1))
+            + chunk(b"IEND", b""))
+
+
+class MockComfyUi:
+    """
+    Parameters:
+    - latency (float): Mean processing time of a prompt, in seconds.
+    - jitter (float): Uniform +/- variation of the processing time.
+    - slots (int): Prompts executed at the same time (GPUs).
+    - upload_latency (float): Seconds spent on each /upload/image.
+    - fail_rate (float): Fraction of prompts that end with execution_error.
+    - image_size (int): Side of the square PNG returned by /view.
+    """
+
+    def __init__(self, latency: float = 8.0, jitter: float = 2.0, slots: int = 1, upload_latency: float = 0.05,
+                 fail_rate: float = 0.0, image_size: int = 1024):
+        self.latency = latency
+        self.jitter = jitter
+        self.slots = slots
+        self.upload_latency = upload_latency
+        self.fail_rate = fail_rate
+        self.image = make_png(image_size, image_size)
+        self.queue = []  # (number, prompt_id, prompt, client_id), na ordem de chegada
+        self.running = {}
+        self.history = {}
+        self.sockets = {}
+        self.counter = 0
+        self.work_available = asyncio.Event()
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.add_routes([
+            web.post("/upload/image", self.upload_image),
+            web.post("/prompt", self.post_prompt),
+            web.get("/history", self.get_history),
+            web.get("/history/{prompt_id}", self.get_history),
+            web.get("/view", self.view),
+            web.get("/queue", self.get_queue),
+            web.post("/queue", self.post_queue),
+            web.post("/interrupt", self.interrupt),
+            web.get("/system_stats", self.system_stats),
+            web.get("/ws", self.websocket),
+        ])
+        app.on_startup.append(self._start_workers)
+        return app
+
+    async def _start_workers(self, app):
+        for _ in range(self.slots):
+            asyncio.create_task(self._worker())
+
+    async def upload_image(self, request):
+        form = await request.post()
+        image = form["image"]
+        image.file.read()
+        await asyncio.sleep(self.upload_latency)
+        return web.json_response({"name": image.filename, "subfolder": form.get("subfolder", ""), "type": "input"})
+
+    async def post_prompt(self, request):
+        body = await request.json()
+        prompt_id = str(uuid.uuid4())
+        self.counter += 1
+        self.queue.append((self.counter, prompt_id, body["prompt"], body.get("client_id")))
+        self.work_available.set()
+        await self._broadcast_status()
+        return web.json_response({"prompt_id": prompt_id, "number": self.counter, "node_errors": {}})
+
+    async def get_history(self, request):
+        prompt_id = request.match_info.get("prompt_id")
+        if prompt_id is not None:
+            return web.json_response({prompt_id: self.history[prompt_id]} if prompt_id in self.history else {})
+        max_items = int(request.query.get("max_items", len(self.history)))
+        items = list(self.history.items())[-max_items:] if max_items else []
+        return web.json_response(dict(items))
+
+    async def view(self, request):
+        return web.Response(body=self.image, content_type="image/png")
+
+    async def get_queue(self, request):
+        return web.json_response({
+            "queue_running": [[number, prompt_id, {}, {}, []] for prompt_id, (number, _) in self.running.items()],
+            "queue_pending": [[number, prompt_id, {}, {}, []] for number, prompt_id, _, _ in self.queue],
+        })
+
+    async def post_queue(self, request):
+        body = await request.json()
+        if body.get("clear"):
+            self.queue.clear()
+        delete = set(body.get("delete", []))
+        self.queue = [item for item in self.queue if item[1] not in delete]
+        await self._broadcast_status()
+        return web.Response()
+
+    async def interrupt(self, request):
+        # como no ComfyUI recente: com prompt_id so interrompe se for esse o prompt em execucao
+        body = await request.json() if request.can_read_body else {}
+        prompt_id = (body or {}).get("prompt_id")
+        for running_id, (_, task) in list(self.running.items()):
+            if prompt_id is None or running_id == prompt_id:
+                task.cancel()
+        return web.Response()
+
+    async def system_stats(self, request):
+        return web.json_response({"system": {"comfyui_version": "mock"},
+                                  "devices": [{"name": "mock", "type": "cuda", "vram_total": 24 * 1024 ** 3,
+                                               "vram_free": 20 * 1024 ** 3}]})
+
+    async def websocket(self, request):
+        client_id = request.query.get("clientId") or str(uuid.uuid4())
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+        self.sockets[client_id] = ws
+        await ws.send_json({"type": "status", "data": {"status": self._status(), "sid": client_id}})
+        try:
+            async for message in ws:
+                if message.type == WSMsgType.ERROR:
+                    break
+        finally:
+            if self.sockets.get(client_id) is ws:
+                del self.sockets[client_id]
+        return ws
+
+    def _status(self) -> dict:
+        return {"exec_info": {"queue_remaining": len(self.queue) + len(self.running)}}
+
+    async def _broadcast_status(self):
+        for ws in list(self.sockets.values()):
+            await self._send(ws, {"type": "status", "data": {"status": self._status()}})
+
+    async def _send(self, ws, message):
+        if ws is not None and not ws.closed:
+            try:
+                await ws.send_json(message)
+            except (ConnectionError, RuntimeError) as e:
+                logger.debug(f"Could not send {message['type']}: {e}")
+
+    async def _worker(self):
+        while True:
+            while not self.queue:
+                self.work_available.clear()
+                await self.work_available.wait()
+            number, prompt_id, prompt, client_id = self.queue.pop(0)
+            task = asyncio.create_task(self._execute(prompt_id, prompt, client_id))
+            self.running[prompt_id] = (number, task)
+            try:
+                await task
+            except asyncio.CancelledError:
+                await self._send(self.sockets.get(client_id), {"type": "execution_interrupted",
+                                                               "data": {"prompt_id": prompt_id}})
+            except Exception:
+                # um prompt com problema nao pode parar a fila inteira
+                logger.exception(f"Prompt {prompt_id} failed in the mock.")
+                self.history[prompt_id] = {"prompt": [], "outputs": {},
+                                           "status": {"status_str": "error", "completed": False}}
+            finally:
+                del self.running[prompt_id]
+                try:
+                    await self._broadcast_status()
+                except Exception:
+                    logger.exception("Could not broadcast the queue status.")
+
+    async def _execute(self, prompt_id: str, prompt: dict, client_id: str):
+        ws = lambda: self.sockets.get(client_id)  # o cliente pode reconectar durante a execucao
+        started = int(time.time() * 1000)  # ms, como o ComfyUI
+        await self._send(ws(), {"type": "execution_start", "data": {"prompt_id": prompt_id, "timestamp": started}})
+
+        duration = max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+        nodes = list(prompt) or ["1"]
+        for node_id in nodes:
+            await self._send(ws(), {"type": "executing", "data": {"node": node_id, "prompt_id": prompt_id}})
+            await asyncio.sleep(duration / len(nodes))
+
+        # um prompt em lote tem um SaveImage por membro
+        output_nodes = [node_id for node_id, node in prompt.items() if node.get("class_type") == "SaveImage"]
+        output_nodes = output_nodes or nodes[-1:]
+        if random.random() < self.fail_rate:
+            self.history[prompt_id] = {"prompt": [], "outputs": {},
+                                       "status": {"status_str": "error", "completed": False}}
+            await self._send(ws(), {"type": "execution_error", "data": {
+                "prompt_id": prompt_id, "node_id": output_nodes[0], "node_type": "SaveImage",
+                "exception_message": "mock failure"}})
+            return
+
+        outputs = {node_id: {"images": [{"filename": f"mock_{prompt_id[:8]}_{index}.png", "subfolder": "",
+                                         "type": "output"}]}
+                   for index, node_id in enumerate(output_nodes)}
+        messages = [["execution_start", {"prompt_id": prompt_id, "timestamp": started}],
+                    ["execution_success", {"prompt_id": prompt_id, "timestamp": int(time.time() * 1000)}]]
+        self.history[prompt_id] = {"prompt": [], "outputs": outputs,
+                                   "status": {"status_str": "success", "completed": True, "messages": messages}}
+        for node_id, output in outputs.items():
+            await self._send(ws(), {"type": "executed", "data": {"node": node_id, "output": output,
+                                                                 "prompt_id": prompt_id}})
+        await self._send(ws(), {"type": "executing", "data": {"node": None, "prompt_id": prompt_id}})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock ComfyUI server for load tests.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7821)
+    parser.add_argument("--latency", type=float, default=8.0, help="mean processing time per prompt (s)")
+    parser.add_argument("--jitter", type=float, default=2.0, help="+/- variation of the processing time (s)")
+    parser.add_argument("--slots", type=int, default=1, help="prompts executed at the same time")
+    parser.add_argument("--upload-latency", type=float, default=0.05, help="seconds per upload")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of prompts that fail")
+    parser.add_argument("--image-size", type=int, default=1024, help="side of the output PNG")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    mock = MockComfyUi(args.latency, args.jitter, args.slots, args.upload_latency, args.fail_rate, args.image_size)
+    web.run_app(mock.app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Per-node execution profile of the ComfyUI workflows.
+
+The clients feed it the node wall times measured from the `executing`
+messages of every generation; it aggregates them per workflow file and
+persists the totals, so the numbers survive restarts. Nodes that report
+`progress` (the samplers) also get their time per step, which stays
+comparable when the step count of a workflow changes.
+
+Report (compare workflows side by side):
+    python node_profiler.py
+    python node_profiler.py amstel_ipadapter_api_v14.json amstel_production_model.json
+"""
+import argparse
+import atexit
+import json
+import os
+import threading
+import logging
+
+import parameters as param
+
+logger = logging.getLogger(__name__)
+
+
+class NodeProfiler:
+    """
+    `record` only updates the totals in memory; `flush()` (called by the
+    apps' scheduler and at exit) writes them out.
+
+    Parameters:
+    - path (str): JSON file where the aggregated profile is kept.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.dirty = False
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        self.workflows = self._load()
+
+    def record(self, workflow_name: str, workflow: dict, profile: dict):
+        """Adds one execution: `profile` is the dict from ComfyUiEventStream (node_times, cached, progress_steps)."""
+        if not profile:
+            return
+        with self.lock:
+            entry = self.workflows.setdefault(workflow_name, {"runs": 0, "total": 0.0, "nodes": {}})
+            self.dirty = True
+            entry["runs"] += 1
+            entry["total"] += sum(profile["node_times"].values())
+            for node_id, seconds in profile["node_times"].items():
+                node = entry["nodes"].setdefault(node_id, {
+                    "class_type": workflow.get(node_id, {}).get("class_type", ""),
+                    "runs": 0, "total": 0.0, "min": seconds, "max": seconds, "cached": 0})
+                node["runs"] += 1
+                node["total"] += seconds
+                node["min"] = min(node["min"], seconds)
+                node["max"] = max(node["max"], seconds)
+            for node_id in profile.get("cached", []):
+                if node_id in entry["nodes"]:
+                    entry["nodes"][node_id]["cached"] += 1
+            # nos com barra de progresso (KSampler): tempo por passo, comparavel entre contagens de passos
+            for node_id, steps in profile.get("progress_steps", {}).items():
+                if steps and node_id in profile["node_times"]:
+                    node = entry["nodes"][node_id]
+                    node["steps"] = node.get("steps", 0) + steps
+                    node["stepped_total"] = node.get("stepped_total", 0.0) + profile["node_times"][node_id]
+
+    def report(self, workflow_names: list = None) -> str:
+        with self.lock:
+            workflows = {name: entry for name, entry in self.workflows.items()
+                         if not workflow_names or name in workflow_names}
+
+        lines = []
+        for name, entry in workflows.items():
+            mean_total = entry["total"] / entry["runs"] if entry["runs"] else 0.0
+            lines.append(f"== {name}: {entry['runs']} runs, {mean_total:.2f}s per run")
+            lines.append(f"{'node':>6}  {'class_type':<32}{'mean':>8}{'max':>8}{'share':>8}{'cached':>8}{'s/step':>8}")
+            nodes = sorted(entry["nodes"].items(), key=lambda item: item[1]["total"], reverse=True)
+            for node_id, node in nodes:
+                mean = node["total"] / entry["runs"]
+                share = 100 * node["total"] / entry["total"] if entry["total"] else 0.0
+                per_step = f"{node['stepped_total'] / node['steps']:>7.3f}s" if node.get("steps") else f"{'-':>8}"
+                lines.append(f"{node_id:>6}  {node['class_type'][:31]:<32}{mean:>7.2f}s{node['max']:>7.2f}s"
+                             f"{share:>7.1f}%{node['cached']:>8}{per_step}")
+            lines.append("")
+
+        if len(workflows) > 1:
+            lines.append(self._compare(workflows))
+        return "\n".join(lines)
+
+    def _compare(self, workflows: dict) -> str:
+        # mesmo no pode ter IDs diferentes em cada workflow: compara pelo class_type
+        names = list(workflows)
+        per_class = {}
+        for name, entry in workflows.items():
+            for node in entry["nodes"].values():
+                mean = node["total"] / entry["runs"]
+                per_class.setdefault(node["class_type"], {}).setdefault(name, 0.0)
+                per_class[node["class_type"]][name] += mean
+
+        header = f"{'class_type':<32}" + "".join(f"{name[:22]:>24}" for name in names)
+        lines = ["== mean seconds per run, by class_type", header]
+        for class_type, by_workflow in sorted(per_class.items(), key=lambda item: -max(item[1].values())):
+            lines.append(f"{class_type[:31]:<32}" + "".join(
+                f"{by_workflow[name]:>23.2f}s" if name in by_workflow else f"{'-':>24}" for name in names))
+        lines.append(f"{'TOTAL':<32}" + "".join(
+            f"{workflows[name]['total'] / max(workflows[name]['runs'], 1):>23.2f}s" for name in names))
+        return "\n".join(lines)
+
+    def flush(self):
+        # so grava se algo mudou: rodar o relatorio nao pode sobrescrever o arquivo do servidor.
+        # O JSON e serializado dentro do lock, mas a escrita no disco fica fora dele
+        with self.save_lock:
+            with self.lock:
+                if not self.dirty:
+                    return
+                self.dirty = False
+                data = json.dumps(self.workflows, separators=(",", ":"))
+            if not self._save(data):
+                with self.lock:
+                    self.dirty = True
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            logger.warning(f"Node profile {self.path} is invalid, starting over: {e}")
+            return {}
+
+    def _save(self, data: str) -> bool:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        partial = f"{self.path}.part"
+        try:
+            with open(partial, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(partial, self.path)
+            return True
+        except OSError as e:
+            logger.warning(f"Could not save node profile {self.path}: {e}")
+            return False
+
+
+profiler = NodeProfiler(param.NODE_PROFILE_PATH)
+atexit.register(profiler.flush)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-node execution profile of the ComfyUI workflows.")
+    parser.add_argument("workflows", nargs="*", help="workflow file names to show (default: all)")
+    parser.add_argument("--profile", default=param.NODE_PROFILE_PATH, help="profile JSON file")
+    args = parser.parse_args()
+
+    print(NodeProfiler(args.profile).report([os.path.basename(w) for w in args.workflows]))
+
+
+if __name__ == "__main__":
+    main()
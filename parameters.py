@@ -7,14 +7,71 @@ UDP_PORT = 7001
 LOG_API = "https://dbutils.ddns.net"
 LOG_BACKUP_FILE = ""
 LOG_PROJECT_ID = "67fd69a1ea2390daf9e11397"
+LOG_FLUSH_INTERVAL_MS = 200  # as linhas do datalog sao gravadas em grupo a cada intervalo
+LOG_SEND_INTERVAL = 120
+LOG_SEND_CONCURRENCY = 4
+LOG_SEND_TIMEOUT = 10
+# rota de envio em lote (lista JSON de linhas); None envia uma linha por requisicao
+LOG_BATCH_API = None
+LOG_BATCH_SIZE = 100
 TIMER_TERMS = "20"
 # COMFYUI_API_SERVER = "kingsdayapp.ngrok.app:7821"
 COMFYUI_API_SERVER = "localhost:7821"
+# adicione mais servidores GPU aqui; as geracoes vao para o de menor fila
+COMFYUI_API_SERVERS = [COMFYUI_API_SERVER]
+COMFYUI_POOL_MAXSIZE = 16
+COMFYUI_CONNECT_TIMEOUT = 3.05
+COMFYUI_READ_TIMEOUT = 60
 # COMFYUI_API_SERVER = "http://k8s-default-comfyuia-2fff7010b1-1858600232.sa-east-1.elb.amazonaws.com"
 IMAGE_TEMP_FOLDER = r"temp"
 WORKFLOW_PATH = r"workflows/amstel_production_model.json"
 WORKFLOW_NODE_ID_KSAMPLER = "3"
 WORKFLOW_NODE_ID_IMAGE_LOAD = "15"
 WORKFLOW_NODE_ID_TEXT_INPUT = "28"
+WORKFLOW_OUTPUT_NODE = "SaveImage"  # ID ou class_type do no com a imagem final
+WORKFLOW_OUTPUT_INDEX = 0
 CONFIG_INDEX = 6
-SERVER_PORT=5003
\ No newline at end of file
+SERVER_PORT=5003
+JOB_MAX_WORKERS = 8
+JOB_MAX_PENDING = 500
+JOB_TTL_SECONDS = 900
+JOB_ABANDON_SECONDS = 60  # job sem nenhuma consulta (polling/SSE) por esse tempo e cancelado
+GENERATION_TIMEOUT = 180  # prazo de cada geracao; passado isso o prompt sai da fila do ComfyUI
+# micro-batching: pedidos com a mesma escolha que chegam dentro da janela vao num unico prompt
+BATCH_WINDOW_MS = 0  # 0 desliga; ex.: 250 (cada pedido espera no maximo isso a mais)
+BATCH_MAX_SIZE = 4  # lote cheio e enviado na hora
+# controle de admissao: acima disso /api/upload responde 429 com Retry-After
+ADMISSION_MAX_OUTSTANDING = 40
+ADMISSION_PARALLELISM = None  # geracoes simultaneas nas GPUs; None = numero de servidores
+ADMISSION_INITIAL_SERVICE_TIME = 15
+
+# uploads menores que isso ficam so em memoria
+UPLOAD_SPOOL_THRESHOLD = 4 * 1024 * 1024
+# grava uma copia da foto enviada em static/inputs, fora do caminho critico
+ARCHIVE_INPUTS = True
+# reduz a foto (orientacao EXIF, lado maior e JPEG) antes de enviar para a GPU
+PREPROCESS_INPUTS = True
+PREPROCESS_MAX_SIDE = None  # None = resolucao de trabalho do workflow (no ImageResize+)
+PREPROCESS_JPEG_QUALITY = 90
+PREPROCESS_WORKERS = 2
+# versoes extras da imagem gerada ("png" otimizado, "jpg", "webp"), feitas em background
+OUTPUT_VARIANTS = []
+OUTPUT_VARIANT_WORKERS = 1
+# contador de geracoes por hora usado no /stats
+ACTIVITY_INDEX_PATH = "data/activity_index.json"
+ACTIVITY_INDEX_SAVE_SECONDS = 30
+# limpeza de arquivos gerados: validade e cota em disco por pasta
+RETENTION_SWEEP_SECONDS = 60
+RETENTION_RULES = {
+    "static/outputs": {"ttl_minutes": 60, "quota_mb": 5000},
+    "static/inputs": {"ttl_minutes": 60, "quota_mb": 2000},
+    "static/download_images": {"ttl_minutes": 10, "quota_mb": 5000, "discover": True},
+    "static/thumbnails": {"ttl_minutes": 10, "quota_mb": 1000, "discover": True},
+}
+# com nginx na frente: prefixo da location internal que aponta para static/ (ex.: "/protected-static/")
+X_ACCEL_REDIRECT_PREFIX = None
+# larguras das miniaturas das galerias (srcset)
+THUMBNAIL_WIDTHS = [320, 640, 1080]
+# tempo por no de cada workflow (python node_profiler.py mostra o relatorio)
+NODE_PROFILE_PATH = "data/node_profile.json"
+NODE_PROFILE_SAVE_SECONDS = 30
@@ -1,7 +1,17 @@
 import qrcode
 import io
+import hashlib
+from functools import lru_cache
 
-def generate_qr_code(data):
+BACKGROUND_COLOR = (227, 217, 185)
+
+
+@lru_cache(maxsize=256)
+def qr_code_png(data):
+    """
+    Returns (png_bytes, etag) for the QR code of `data`. The same payload
+    always produces the same image, so it is encoded once and cached.
+    """
     qr = qrcode.QRCode(
         version=1,
         error_correction=qrcode.constants.ERROR_CORRECT_L,
@@ -11,16 +21,19 @@ def generate_qr_code(data):
     qr.add_data(data)
     qr.make(fit=True)
 
-    img = qr.make_image(fill_color="black", back_color="white").convert('RGB')
-
-    pixels = img.load()
-    for y in range(img.size[1]):
-        for x in range(img.size[0]):
-            if pixels[x, y] == (255, 255, 255):
-                pixels[x, y] = (227, 217, 185)
+    # imagem de 1 bit convertida para paleta: trocar o branco e so mudar uma entrada da paleta
+    img = qr.make_image(fill_color="black", back_color="white").get_image().convert('P')
+    palette = img.getpalette()
+    palette[255 * 3:255 * 3 + 3] = BACKGROUND_COLOR
+    img.putpalette(palette)
 
     img_bytes = io.BytesIO()
-    img.save(img_bytes, format='PNG')
-    img_bytes.seek(0)
+    img.save(img_bytes, format='PNG', optimize=True)
+    png = img_bytes.getvalue()
 
-    return img_bytes
+    return png, hashlib.sha1(png).hexdigest()
+
+
+def generate_qr_code(data):
+    png, _ = qr_code_png(data)
+    return io.BytesIO(png)
@@ -0,0 +1,225 @@
+import heapq
+import itertools
+import os
+import shutil
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# pasta com conteudo mais novo que isso em relacao a ultima medida e medida de novo no sweep
+SETTLE_SECONDS = 30
+
+
+class _Artifact:
+    __slots__ = ("path", "size", "expires_at", "alive", "is_dir", "mtime", "measured_at")
+
+    def __init__(self, path: str, size: int, expires_at: float):
+        self.path = path
+        self.size = size
+        self.expires_at = expires_at
+        self.alive = True
+        self.is_dir = os.path.isdir(path)
+        self.mtime = _mtime_of(path) if self.is_dir else None
+        self.measured_at = time.time()
+
+
+class _ManagedDirectory:
+    def __init__(self, path: str, ttl_minutes: float, quota_mb: float = None, discover: bool = False):
+        self.path = path
+        self.ttl = ttl_minutes * 60
+        self.quota = int(quota_mb * 1024 * 1024) if quota_mb else None
+        self.discover = discover
+        self.discovered_mtime = None
+        self.heap = []  # (expires_at, seq, artifact), o mais antigo primeiro
+        self.artifacts = {}
+        self.unsettled = {}  # pastas ainda sendo escritas, medidas de novo a cada sweep
+        self.bytes = 0
+        self.deleted = 0
+        self.deleted_bytes = 0
+        self.evicted = 0
+
+
+class RetentionManager:
+    """
+    Deletes generated artifacts (files or folders) once they expire, and
+    the oldest ones first when a directory goes over its byte quota.
+
+    Artifacts are registered with `track` when they are written, into a
+    per-directory heap ordered by expiry, so a sweep only touches what
+    has expired: it costs O(expired log n), not a listing of the directory.
+    Directories are listed once at startup to pick up what is already on
+    disk. Directories filled by other processes can set `discover`; they
+    are listed again only when their modification time changes.
+
+    Folder artifacts are usually registered right after being created,
+    before their files are written. They stay on an "unsettled" list, and
+    each sweep measures them again until their modification time has been
+    stable for SETTLE_SECONDS. After that they are no longer visited, so the
+    sweep cost stays proportional to the expired and still-changing
+    artifacts.
+
+    `sweep` is meant to run on a scheduler thread; `track` is a heap push
+    and is safe to call from request threads.
+
+    Parameters:
+    - rules (dict): directory -> {"ttl_minutes", "quota_mb" (optional), "discover" (optional)}.
+    """
+
+    def __init__(self, rules: dict):
+        self.directories = {os.path.normpath(path): _ManagedDirectory(os.path.normpath(path), **rule)
+                            for path, rule in rules.items()}
+        self.sequence = itertools.count()
+        self.lock = threading.Lock()
+        for directory in self.directories.values():
+            os.makedirs(directory.path, exist_ok=True)
+            if directory.discover:
+                self._discover(directory)
+            else:
+                self._scan(directory)
+
+    def track(self, path: str, size: int = None, created_at: float = None):
+        """Registers a file or folder written inside one of the managed directories."""
+        directory = self.directories.get(os.path.dirname(os.path.normpath(path)))
+        if directory is None:
+            logger.debug(f"{path} is not in a managed directory, not tracked.")
+            return
+        if size is None:
+            size = _size_of(path)
+        self._add(directory, os.path.normpath(path), size, (created_at or time.time()) + directory.ttl)
+
+    def sweep(self):
+        now = time.time()
+        for directory in self.directories.values():
+            if directory.discover:
+                self._discover(directory)
+            self._remeasure(directory, now)
+
+            while True:
+                with self.lock:
+                    artifact = self._pop_due(directory, now)
+                if artifact is None:
+                    break
+                self._delete(directory, artifact)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {d.path: {"files": len(d.artifacts), "bytes": d.bytes, "quota_bytes": d.quota,
+                             "deleted": d.deleted, "deleted_bytes": d.deleted_bytes, "evicted_by_quota": d.evicted}
+                    for d in self.directories.values()}
+
+    def _add(self, directory: _ManagedDirectory, path: str, size: int, expires_at: float):
+        artifact = _Artifact(path, size, expires_at)
+        with self.lock:
+            previous = directory.artifacts.get(path)
+            if previous is not None:
+                # arquivo reescrito: a entrada antiga fica no heap mas e ignorada
+                previous.alive = False
+                directory.bytes -= previous.size
+            directory.artifacts[path] = artifact
+            directory.unsettled.pop(path, None)
+            if artifact.is_dir:
+                directory.unsettled[path] = artifact
+            directory.bytes += size
+            heapq.heappush(directory.heap, (expires_at, next(self.sequence), artifact))
+
+    def _pop_due(self, directory: _ManagedDirectory, now: float):
+        # devolve o proximo artefato vencido ou, se a pasta passou da cota, o mais antigo
+        while directory.heap:
+            expires_at, _, artifact = directory.heap[0]
+            if not artifact.alive:
+                heapq.heappop(directory.heap)
+                continue
+            over_quota = directory.quota is not None and directory.bytes > directory.quota
+            if expires_at > now and not over_quota:
+                return None
+            heapq.heappop(directory.heap)
+            artifact.alive = False
+            del directory.artifacts[artifact.path]
+            directory.unsettled.pop(artifact.path, None)
+            directory.bytes -= artifact.size
+            if expires_at > now:
+                directory.evicted += 1
+            return artifact
+        return None
+
+    def _delete(self, directory: _ManagedDirectory, artifact: _Artifact):
+        try:
+            if os.path.isdir(artifact.path):
+                shutil.rmtree(artifact.path)
+            else:
+                os.remove(artifact.path)
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            logger.warning(f"Could not remove {artifact.path}: {e}")
+            return
+        with self.lock:
+            directory.deleted += 1
+            directory.deleted_bytes += artifact.size
+        logger.debug(f"Removed {artifact.path}.")
+
+    def _scan(self, directory: _ManagedDirectory):
+        known = set(directory.artifacts)
+        for entry in os.scandir(directory.path):
+            path = os.path.normpath(entry.path)
+            # .part: download em andamento; desktop.ini e ocultos nao sao artefatos
+            if path in known or entry.name.endswith(".part") or entry.name.startswith(".") \
+                    or entry.name.lower() == "desktop.ini":
+                continue
+            stat = entry.stat()
+            size = stat.st_size if entry.is_file() else _size_of(entry.path)
+            self._add(directory, path, size, stat.st_mtime + directory.ttl)
+
+    def _remeasure(self, directory: _ManagedDirectory, now: float):
+        with self.lock:
+            folders = list(directory.unsettled.values())
+        for artifact in folders:
+            mtime = _mtime_of(artifact.path)
+            # pasta sem mudancas desde uma medida feita com ela ja assentada: tamanho vale, sai da lista
+            if mtime is None or (mtime == artifact.mtime and artifact.measured_at - mtime >= SETTLE_SECONDS):
+                with self.lock:
+                    if directory.unsettled.get(artifact.path) is artifact:
+                        del directory.unsettled[artifact.path]
+                continue
+            size = _size_of(artifact.path)
+            with self.lock:
+                if artifact.alive:
+                    directory.bytes += size - artifact.size
+                    artifact.size = size
+                artifact.mtime = mtime
+                artifact.measured_at = now
+
+    def _discover(self, directory: _ManagedDirectory):
+        try:
+            mtime = os.stat(directory.path).st_mtime
+        except FileNotFoundError:
+            return
+        if mtime != directory.discovered_mtime:
+            directory.discovered_mtime = mtime
+            self._scan(directory)
+
+
+def _mtime_of(path: str) -> float:
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _size_of(path: str) -> int:
+    if not os.path.isdir(path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
@@ -1,3 +1,5 @@
+import os
+import tempfile
 import requests
 import uuid
 import json
@@ -56,8 +58,9 @@ def get_images(prompt, client_id, server_address):
         if 'images' in node_output and node_output['images'][0]['type'] == 'output':
             images_output = []
             for image in node_output['images']:
-                image_data = comfyui_api_utils.get_image(image['filename'], image['subfolder'], image['type'], server_address, aws_alb_cookie)
-                images_output.append(image_data)
+                destination = os.path.join(tempfile.gettempdir(), image['filename'])
+                image_path = comfyui_api_utils.download_image(image['filename'], image['subfolder'], image['type'], server_address, aws_alb_cookie, destination)
+                images_output.append(image_path)
             output_images[node_id] = images_output
     return output_images, prompt_id
 
@@ -73,10 +76,9 @@ def single_inference(server_address, request_api_json):
     images, prompt_id = get_images(prompt, client_id, server_address)
     if SHOW_IMAGES:
         for node_id in images:
-            for image_data in images[node_id]:
+            for image_path in images[node_id]:
                 from PIL import Image
-                import io
-                image = Image.open(io.BytesIO(image_data))
+                image = Image.open(image_path)
                 image.show()
     end = time.time()
     timespent = round((end - start), 2)
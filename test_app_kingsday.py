@@ -0,0 +1,32 @@
+import io
+
+import app_kingsday
+
+
+def test_upload_goes_through_spooled_request():
+    # o request_class customizado precisa ser um flask.Request (teardown usa request.blueprints)
+    client = app_kingsday.app.test_client()
+    response = client.post('/api/upload', data={'image': (io.BytesIO(b"not sent"), '')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Nome de arquivo inválido'}
+
+
+def test_admission_state():
+    client = app_kingsday.app.test_client()
+    response = client.get('/api/admission')
+    assert response.status_code == 200
+    assert response.get_json()['outstanding'] == 0
+
+
+def test_failed_spool_releases_admission_ticket(monkeypatch):
+    def broken_spool(stream):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(app_kingsday, 'spool_upload', broken_spool)
+    monkeypatch.setitem(app_kingsday.app.config, 'PROPAGATE_EXCEPTIONS', False)
+    client = app_kingsday.app.test_client()
+    response = client.post('/api/upload', data={'image': (io.BytesIO(b"jpeg"), 'photo.jpg'), 'mode': 'job'},
+                           content_type='multipart/form-data')
+    assert response.status_code == 500
+    assert app_kingsday.admission.stats()['outstanding'] == 0
@@ -0,0 +1,101 @@
+import os
+import tempfile
+import threading
+import logging
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# formato -> (mimetype, formato do PIL, extensao, opcoes de encode), em ordem de preferencia
+THUMBNAIL_FORMATS = [
+    ("image/avif", "AVIF", "avif", {"quality": 60}),
+    ("image/webp", "WEBP", "webp", {"quality": 80, "method": 4}),
+    ("image/jpeg", "JPEG", "jpg", {"quality": 82, "progressive": True, "optimize": True}),
+]
+
+
+class ThumbnailCache:
+    """
+    Width-bounded derivatives of the gallery images, produced on the first
+    request and kept on disk under `root`, mirroring the source folders.
+
+    The format is negotiated from the Accept header: AVIF if the client
+    takes it and Pillow can encode it, then WebP, then JPEG.
+
+    Parameters:
+    - root (str): Folder where the thumbnails are written.
+    - widths (list): Allowed widths in pixels; other requests snap to the next one up.
+    """
+
+    def __init__(self, root: str, widths: list):
+        self.root = root
+        self.widths = sorted(widths)
+        Image.init()
+        self.formats = [f for f in THUMBNAIL_FORMATS if f[1] in Image.SAVE or _load_plugin(f[1])]
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def snap_width(self, width: int) -> int:
+        for allowed in self.widths:
+            if width <= allowed:
+                return allowed
+        return self.widths[-1]
+
+    def negotiate(self, accept) -> tuple:
+        """`accept` is request.accept_mimetypes; JPEG is the fallback every browser takes."""
+        for entry in self.formats:
+            if accept[entry[0]] and entry[0] in accept.values():
+                return entry
+        return self.formats[-1]
+
+    def get(self, source_path: str, relative_name: str, width: int, entry: tuple) -> str:
+        """Returns the thumbnail path, encoding it first if it is not on disk yet."""
+        _, pil_format, extension, options = entry
+        width = self.snap_width(width)
+        stem = os.path.splitext(relative_name)[0]
+        destination = os.path.join(self.root, f"{stem}_w{width}.{extension}")
+        if os.path.isfile(destination):
+            return destination
+
+        # uma so geracao por arquivo, mesmo com varios celulares pedindo a mesma galeria
+        with self.locks_lock:
+            lock = self.locks.setdefault(destination, threading.Lock())
+        with lock:
+            if not os.path.isfile(destination):
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                # nome temporario unico por escrita: o lock sai do dicionario ao final, entao outra thread
+                # pode estar gerando o mesmo arquivo; cada uma escreve no seu e o os.replace e atomico
+                descriptor, partial = tempfile.mkstemp(dir=os.path.dirname(destination),
+                                                       prefix=f"{os.path.basename(destination)}.", suffix=".part")
+                try:
+                    with os.fdopen(descriptor, "wb") as output, Image.open(source_path) as image:
+                        image.draft("RGB", (width, width))
+                        image = ImageOps.exif_transpose(image)
+                        if image.mode not in ("RGB", "RGBA") or pil_format == "JPEG":
+                            image = image.convert("RGB")
+                        if image.width > width:
+                            image = image.resize((width, round(image.height * width / image.width)),
+                                                 Image.Resampling.LANCZOS)
+                        image.save(output, format=pil_format, **options)
+                    os.replace(partial, destination)
+                except BaseException:
+                    if os.path.exists(partial):
+                        os.remove(partial)
+                    raise
+                logger.debug(f"Thumbnail {destination} created.")
+        with self.locks_lock:
+            self.locks.pop(destination, None)
+        return destination
+
+
+def _load_plugin(pil_format: str) -> bool:
+    # AVIF so existe no Pillow com o plugin (pillow-avif-plugin) ou em versoes novas
+    if pil_format == "AVIF":
+        try:
+            import pillow_avif  # noqa: F401
+        except ImportError:
+            return False
+        return pil_format in Image.SAVE
+    return False
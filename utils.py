@@ -5,7 +5,8 @@ import io
 from collections import defaultdict
 
 import base64
-import matplotlib.pyplot as plt
+import functools
+from xml.sax.saxutils import escape
 
 
 def create_zip_of_images(folder_path):
@@ -113,12 +114,30 @@ def count_files_by_hour(directory_path: str) -> dict:
     return dict(file_counts)
 
 
+def activity_series(file_activity: dict) -> tuple:
+    """
+    Returns the activity as a sorted tuple of (hour, count) pairs. It is
+    hashable, so the charts below are memoized on it and only re-rendered
+    when an hour bucket changes.
+    """
+    return tuple(sorted(file_activity.items()))
+
+
 def generate_file_activity_plot_base64(file_activity: dict, style: str = "bar") -> str:
     if not file_activity:
         return ""
+    return _activity_plot_base64(activity_series(file_activity), style)
 
-    times = sorted(file_activity.keys())
-    counts = [file_activity[t] for t in times]
+
+@functools.lru_cache(maxsize=8)
+def _activity_plot_base64(series: tuple, style: str) -> str:
+    # importado so quando um PNG e pedido: o matplotlib pesa no startup
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    times = [t for t, _ in series]
+    counts = [c for _, c in series]
 
     plt.figure(figsize=(12, 6))
 
@@ -143,6 +162,66 @@ def generate_file_activity_plot_base64(file_activity: dict, style: str = "bar")
     return img_base64
 
 
+def generate_file_activity_svg(file_activity: dict, width: int = 800, height: int = 400) -> str:
+    """
+    Renders the activity per hour as an inline SVG line chart, without
+    matplotlib.
+
+    Parameters:
+    - file_activity (dict): datetime (start of the hour) -> count.
+    - width (int): Chart width in pixels.
+    - height (int): Chart height in pixels.
+
+    Returns:
+    - str: The <svg> element, or an empty string if there is no activity.
+    """
+    if not file_activity:
+        return ""
+    return _activity_svg(activity_series(file_activity), width, height)
+
+
+@functools.lru_cache(maxsize=8)
+def _activity_svg(series: tuple, width: int, height: int) -> str:
+    left, right, top, bottom = 50, 20, 20, 70
+    plot_width = width - left - right
+    plot_height = height - top - bottom
+    max_count = max(c for _, c in series) or 1
+    step = plot_width / max(len(series) - 1, 1)
+
+    def x(i):
+        return left + i * step
+
+    def y(count):
+        return top + plot_height - count / max_count * plot_height
+
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {width} {height}" '
+             f'class="graph-img" role="img" aria-label="Files per hour">',
+             f'<rect width="{width}" height="{height}" fill="#fff"/>']
+
+    # linhas de grade e rotulos do eixo Y
+    for i in range(5):
+        value = max_count * i / 4
+        parts.append(f'<line x1="{left}" x2="{width - right}" y1="{y(value):.1f}" y2="{y(value):.1f}" stroke="#ddd"/>')
+        parts.append(f'<text x="{left - 6}" y="{y(value) + 4:.1f}" font-size="11" text-anchor="end">{value:.0f}</text>')
+
+    # no maximo ~12 rotulos no eixo X
+    label_every = max(1, len(series) // 12)
+    for i, (hour, _) in enumerate(series):
+        if i % label_every == 0 or i == len(series) - 1:
+            label = escape(hour.strftime("%d/%m %Hh"))
+            parts.append(f'<text x="{x(i):.1f}" y="{top + plot_height + 14}" font-size="11" text-anchor="end" '
+                         f'transform="rotate(-45 {x(i):.1f} {top + plot_height + 14})">{label}</text>')
+
+    points = " ".join(f"{x(i):.1f},{y(c):.1f}" for i, (_, c) in enumerate(series))
+    parts.append(f'<polyline points="{points}" fill="none" stroke="royalblue" stroke-width="2"/>')
+    for i, (hour, count) in enumerate(series):
+        parts.append(f'<circle cx="{x(i):.1f}" cy="{y(count):.1f}" r="3" fill="royalblue">'
+                     f'<title>{escape(hour.strftime("%d/%m %Hh"))}: {count}</title></circle>')
+
+    parts.append('</svg>')
+    return "".join(parts)
+
+
 if __name__ == "__main__":
     pass
 
@@ -0,0 +1,239 @@
+import copy
+import json
+import os
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def resolve_node(workflow: dict, ref: str) -> str:
+    """
+    Returns the node ID for `ref`, which is either a node ID or a class_type
+    that appears exactly once in the workflow.
+    """
+    if ref in workflow:
+        return ref
+    matches = [node_id for node_id, node in workflow.items() if node.get("class_type") == ref]
+    if len(matches) != 1:
+        raise ValueError(f"'{ref}' must be a node ID or a unique class_type (found {len(matches)} nodes)")
+    return matches[0]
+
+
+def _is_link(workflow: dict, value) -> bool:
+    # entrada ligada a saida de outro no: [node_id, indice_da_saida]
+    return isinstance(value, list) and len(value) == 2 and isinstance(value[0], str) and value[0] in workflow
+
+
+def downstream_nodes(workflow: dict, roots) -> set:
+    """`roots` and every node that consumes, directly or not, one of their outputs."""
+    consumers = {}
+    for node_id, node in workflow.items():
+        for value in node.get("inputs", {}).values():
+            if _is_link(workflow, value):
+                consumers.setdefault(value[0], []).append(node_id)
+    seen = set(roots)
+    stack = list(roots)
+    while stack:
+        for consumer in consumers.get(stack.pop(), []):
+            if consumer not in seen:
+                seen.add(consumer)
+                stack.append(consumer)
+    return seen
+
+
+def prompt_payload(prompt, client_id: str) -> bytes:
+    """Body for POST /prompt; `prompt` is a dict or an already rendered JSON string."""
+    if not isinstance(prompt, str):
+        prompt = json.dumps(prompt)
+    return f'{{"prompt": {prompt}, "client_id": {json.dumps(client_id)}}}'.encode('utf-8')
+
+
+class CompiledWorkflow:
+    """
+    A workflow serialized once, with holes for the values that change per
+    request. `render` splices JSON-encoded values into the pre-serialized
+    chunks, so no dict is copied and the graph is not re-encoded per job.
+
+    The workflow also declares which image is the result: image
+    `output_index` of the `output` node. Only that file is downloaded.
+
+    Parameters:
+    - path (str): Workflow file in ComfyUI API format.
+    - slots (dict): name -> (node ID or unique class_type, input name).
+    - output (str): Node ID or unique class_type of the node with the result.
+    - output_index (int): Which image of that node is the result.
+    """
+
+    def __init__(self, path: str, slots: dict, output: str = "SaveImage", output_index: int = 0):
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        with open(path, "r", encoding="utf-8") as f:
+            self.workflow = json.load(f)
+
+        self.slots = {name: (resolve_node(self.workflow, ref), input_name) for name, (ref, input_name) in slots.items()}
+        self._compile()
+
+        self.output_node = resolve_node(self.workflow, output)
+        self.output_index = output_index
+        self.batched_variants = {}
+        self.batched_lock = threading.Lock()
+
+    def _compile(self):
+        template = copy.deepcopy(self.workflow)
+        markers = {}
+        for name, (node_id, input_name) in self.slots.items():
+            marker = f"\x00slot:{name}\x00"
+            template[node_id]["inputs"][input_name] = marker
+            markers[json.dumps(marker)] = name
+
+        # divide o JSON em pedacos fixos intercalados com os nomes dos slots
+        text = json.dumps(template)
+        self.chunks = []
+        self.order = []
+        positions = sorted((text.index(encoded), encoded) for encoded in markers)
+        start = 0
+        for position, encoded in positions:
+            self.chunks.append(text[start:position])
+            self.order.append(markers[encoded])
+            start = position + len(encoded)
+        self.chunks.append(text[start:])
+
+    def render(self, **values) -> str:
+        parts = [self.chunks[0]]
+        for name, chunk in zip(self.order, self.chunks[1:]):
+            parts.append(json.dumps(values[name]))
+            parts.append(chunk)
+        return "".join(parts)
+
+    def select_output(self, outputs: dict) -> dict:
+        """Picks the result image ({filename, subfolder, type}) from the prompt outputs."""
+        try:
+            return outputs[self.output_node]["images"][self.output_index]
+        except (KeyError, IndexError):
+            raise ValueError(f"Workflow {self.path} produced no image {self.output_index} on node {self.output_node}")
+
+    def class_type(self, node_id: str) -> str:
+        return self.workflow.get(node_id, {}).get("class_type", "")
+
+    def batched(self, size: int, per_request=("seed", "image")) -> "BatchedWorkflow":
+        """Variant of this workflow that runs `size` requests in one prompt (compiled once per size)."""
+        key = (size, tuple(per_request))
+        with self.batched_lock:
+            variant = self.batched_variants.get(key)
+            if variant is None:
+                variant = self.batched_variants[key] = BatchedWorkflow(self, size, per_request)
+            return variant
+
+
+class BatchedWorkflow(CompiledWorkflow):
+    """
+    `size` copies of a workflow merged into one prompt. The nodes that
+    depend on a per-request slot (the input image, the seed) are replicated
+    as "<node_id>_<member>"; the rest exist once and are shared.
+
+    This does not batch GPU work. In the production workflows almost the
+    whole graph depends on the image (tagger, face crop, IPAdapter, the
+    positive text encode, sampler, decode), so each member still runs its
+    own copy; only loaders and constant nodes are shared, and ComfyUI caches
+    those across prompts anyway. What a batch saves is queue entries and
+    completion round trips.
+
+    Parameters:
+    - base (CompiledWorkflow): The single-request workflow.
+    - size (int): Requests per prompt.
+    - per_request (tuple): Slots with a different value for each member; the
+      other slots take one value for the whole batch.
+    """
+
+    def __init__(self, base: CompiledWorkflow, size: int, per_request=("seed", "image")):
+        self.path = base.path
+        self.mtime = base.mtime
+        self.size = size
+        self.per_request = tuple(per_request)
+
+        roots = [base.slots[name][0] for name in self.per_request]
+        replicated = downstream_nodes(base.workflow, roots)
+        if base.output_node not in replicated:
+            raise ValueError(f"Output node {base.output_node} of {base.path} does not depend on {self.per_request}")
+
+        self.workflow = {node_id: node for node_id, node in base.workflow.items() if node_id not in replicated}
+        for member in range(size):
+            for node_id in replicated:
+                node = copy.deepcopy(base.workflow[node_id])
+                node["inputs"] = {name: [f"{value[0]}_{member}", value[1]]
+                                  if _is_link(base.workflow, value) and value[0] in replicated else value
+                                  for name, value in node["inputs"].items()}
+                self.workflow[f"{node_id}_{member}"] = node
+
+        self.slots = {}
+        for name, (node_id, input_name) in base.slots.items():
+            if name in self.per_request:
+                for member in range(size):
+                    self.slots[f"{name}_{member}"] = (f"{node_id}_{member}", input_name)
+            else:
+                self.slots[name] = (node_id, input_name)
+        self._compile()
+
+        self.output_node = base.output_node
+        self.output_index = base.output_index
+
+    def render_batch(self, members: list, **shared) -> str:
+        """`members`: one dict of per-request values per member; `shared`: the other slots."""
+        values = dict(shared)
+        for member, member_values in enumerate(members):
+            for name in self.per_request:
+                values[f"{name}_{member}"] = member_values[name]
+        return self.render(**values)
+
+    def select_output(self, outputs: dict, member: int = 0) -> dict:
+        node_id = f"{self.output_node}_{member}"
+        try:
+            return outputs[node_id]["images"][self.output_index]
+        except (KeyError, IndexError):
+            raise ValueError(f"Batched workflow {self.path} produced no image {self.output_index} on node {node_id}")
+
+    def batched(self, size: int, per_request=("seed", "image")):
+        raise TypeError("A batched workflow cannot be batched again")
+
+
+class WorkflowRegistry:
+    """
+    Compiles each workflow file once and recompiles it when the file changes
+    on disk. The modification time is checked at most every `check_interval`
+    seconds, so `get` costs a dict lookup on the hot path.
+    """
+
+    def __init__(self, check_interval: float = 2.0):
+        self.check_interval = check_interval
+        self.compiled = {}
+        self.checked_at = {}
+        self.lock = threading.Lock()
+
+    def get(self, path: str, slots: dict, output: str = "SaveImage", output_index: int = 0) -> CompiledWorkflow:
+        key = (path, tuple(sorted(slots.items())), output, output_index)
+        now = time.time()
+        compiled = self.compiled.get(key)
+        if compiled is not None and now - self.checked_at[key] < self.check_interval:
+            return compiled
+
+        with self.lock:
+            compiled = self.compiled.get(key)
+            self.checked_at[key] = now
+            try:
+                # getmtime tambem falha se o arquivo sumir por um instante durante um save atomico
+                if compiled is None or os.path.getmtime(path) != compiled.mtime:
+                    if compiled is not None:
+                        logger.info(f"Workflow {path} changed on disk, reloading.")
+                    compiled = CompiledWorkflow(path, slots, output, output_index)
+            except (OSError, ValueError) as e:
+                # arquivo sendo salvo ou invalido: continua com a versao anterior
+                if compiled is None:
+                    raise
+                logger.warning(f"Could not reload workflow {path}: {e}")
+            self.compiled[key] = compiled
+            return compiled
+
+
+registry = WorkflowRegistry()